@@ -0,0 +1,293 @@
+"""
+Firmware benchmarks, run on a host against the simulated board.
+
+Each scenario runs the unmodified code.py, which starts lib/firmware.py,
+with the example config.json through a scripted timeline of key presses
+and reports:
+
+  frame us     mean host time per main loop iteration, from one switch
+               scan to the next
+  frame max    slowest iteration
+  alloc B      mean bytes allocated at the high point of each iteration,
+               less the timer's own, measured in a second run under
+               tracemalloc. CPython allocates int objects that MicroPython
+               doesn't, so compare this with the baseline rather than zero
+  latency ms   mean virtual time from a press in the timeline to the first
+               HID report after it (blank if nothing was sent)
+  LED writes   display writes per iteration
+
+Microbenchmarks time single calls into pmk and the firmware in host
+microseconds. Host timings only compare runs on the same machine; the
+allocation, latency and LED figures are deterministic.
+
+    python benchmarks/bench.py               # run, and compare with baseline
+    python benchmarks/bench.py --save        # run, and save as the baseline
+    python benchmarks/bench.py --check 20    # fail if anything is 20% worse
+
+The baseline is in benchmarks/baseline.json; save a new one after an
+intended change, or when moving to another machine.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "keybow files")
+sys.path.insert(0, os.path.join(ROOT, "lib"))
+
+from pmk import PRESS, RELEASE
+from pmk.platform.simulated import Simulation, Timeline
+
+CODE = os.path.join(ROOT, "code.py")
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Results too noisy from run to run to fail a --check on.
+UNCHECKED = ("frame max us",)
+
+def idle():
+    # Nothing pressed for ten seconds.
+
+    return Timeline(end=10000)
+
+def typing_burst():
+    # 200 taps across the numpad keys of layer 1, one every 30 ms.
+
+    timeline = Timeline()
+    for i in range(200):
+        timeline.tap(9 + i % 7, 100 + i * 30, hold=20)
+    return timeline
+
+def layer_switch():
+    # Holds the modifier and steps through every layer, twice.
+
+    timeline = Timeline()
+    t = 100
+    for _ in range(2):
+        timeline.add(t, 0, True)
+        t += 900
+        for selector in range(1, 9):
+            timeline.tap(selector, t, hold=40)
+            t += 100
+        timeline.add(t, 0, False)
+        t += 200
+    return timeline
+
+def all_keys_held():
+    # Presses every key at once and holds them for two seconds.
+
+    timeline = Timeline()
+    for number in range(16):
+        timeline.add(100, number, True)
+        timeline.add(2100, number, False)
+    return timeline
+
+SCENARIOS = {
+    "idle": idle,
+    "typing_burst": typing_burst,
+    "layer_switch": layer_switch,
+    "all_keys_held": all_keys_held,
+}
+
+class FrameTimer:
+    """
+    Times main loop iterations from one switch scan to the next, and
+    optionally how much each one allocated.
+    """
+    def __init__(self, allocations=False):
+        self.allocations = allocations
+        self.frames = 0
+        self.total = 0
+        self.max = 0
+        self.alloc_bytes = 0
+        self._last = None
+        self._base = 0
+
+    def __call__(self):
+        now = time.perf_counter_ns()
+        if self._last is not None:
+            elapsed = now - self._last
+            self.frames += 1
+            self.total += elapsed
+            self.max = max(self.max, elapsed)
+            if self.allocations:
+                current, peak = tracemalloc.get_traced_memory()
+                self.alloc_bytes += max(0, peak - self._base)
+        if self.allocations:
+            tracemalloc.reset_peak()
+            self._base = tracemalloc.get_traced_memory()[0]
+        self._last = time.perf_counter_ns()
+
+def simulate(timeline, on_scan):
+    # The firmware's serial output, such as its startup time, isn't part
+    # of the results.
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Simulation(timeline, on_scan=on_scan).run(CODE, ROOT)
+
+def latency(timeline, simulation):
+    # Mean virtual ms from each press to the first HID report after it,
+    # over presses that were followed by a report before the next press.
+
+    reports = sorted(t for device in simulation.devices for t, _ in device.reports)
+    presses = [t for t, _, pressed in timeline.steps if pressed]
+    delays = []
+    r = 0
+    for i, t in enumerate(presses):
+        while r < len(reports) and reports[r] < t:
+            r += 1
+        if r == len(reports):
+            break
+        following = presses[i + 1] if i + 1 < len(presses) else None
+        if following is None or reports[r] < following:
+            delays.append(reports[r] - t)
+    return sum(delays) / len(delays) if delays else None
+
+def run_scenario(make_timeline):
+    timer = FrameTimer()
+    timeline = make_timeline()
+    simulation = simulate(timeline, timer)
+    writes = sum(board.display.writes for board in simulation.boards)
+
+    alloc_timer = FrameTimer(allocations=True)
+    tracemalloc.start()
+    try:
+        simulate(make_timeline(), alloc_timer)
+    finally:
+        tracemalloc.stop()
+
+    frames = max(timer.frames, 1)
+    alloc = alloc_timer.alloc_bytes / max(alloc_timer.frames, 1)
+    return {
+        "frame us": timer.total / frames / 1000,
+        "frame max us": timer.max / 1000,
+        "alloc B": max(0, alloc - timer_allocations()),
+        "latency ms": latency(timeline, simulation),
+        "LED writes": writes / frames,
+    }
+
+def timer_allocations(count=1000):
+    # Returns the bytes a FrameTimer measures for itself per iteration,
+    # by timing iterations that do nothing.
+
+    timer = FrameTimer(allocations=True)
+    tracemalloc.start()
+    try:
+        for _ in range(count):
+            timer()
+    finally:
+        tracemalloc.stop()
+    return timer.alloc_bytes / max(timer.frames, 1)
+
+def best_of(func, count, repeat=5):
+    # Returns the best mean time of `count` calls of `func`, in us.
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(count):
+            func()
+        elapsed = (time.perf_counter_ns() - start) / count / 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run_micro():
+    # Starts the firmware against a short idle timeline, then times its
+    # parts.
+
+    simulation = simulate(Timeline(end=100), None)
+    firmware = simulation.namespace["firmware"]
+    keybow = firmware.keybow
+    keybow.governor = None
+    keybow.deep_idle_time = None
+    simulation.timeline.end = 1 << 62
+    key = keybow.keys[9]
+    number = key.number
+
+    def key_update():
+        key.update(1, keybow.ticks)
+        key.update(0, keybow.ticks)
+
+    def keymap_walk():
+        firmware.handle_event(PRESS, number, keybow.ticks)
+        firmware.handle_event(RELEASE, number, keybow.ticks)
+        firmware.scheduler.cancel()
+
+    # Keep pmk on the simulated clock, which the switches advance.
+    simulation.install()
+    try:
+        return {
+            "PMK.update us": best_of(keybow.update, 2000),
+            "Key.update us": best_of(key_update, 5000),
+            "keymap walk us": best_of(keymap_walk, 2000),
+            "set_layer_leds us": best_of(lambda: firmware.set_layer_leds(firmware.layer), 2000),
+            "rotate us": best_of(lambda: keybow.rotate(90), 2000),
+        }
+    finally:
+        simulation.uninstall()
+
+def run_all():
+    results = {}
+    for name, make_timeline in SCENARIOS.items():
+        results[name] = run_scenario(make_timeline)
+    results["micro"] = run_micro()
+    return results
+
+def change(old, new):
+    if not old:
+        return 0 if not new else float("inf")
+    return 100 * (new - old) / old
+
+def report(results, baseline, threshold):
+    # Prints the results next to the baseline, returning the number of
+    # results more than `threshold` percent worse.
+
+    regressions = 0
+    for group, values in results.items():
+        print(group)
+        for name, value in values.items():
+            line = "  {:<20}{:>12}".format(name, _number(value))
+            old = baseline.get(group, {}).get(name) if baseline else None
+            if old is not None and value is not None:
+                delta = change(old, value)
+                line += "{:>12}{:>+9.1f}%".format(_number(old), delta)
+                if threshold is not None and delta > threshold and name not in UNCHECKED:
+                    line += "  REGRESSION"
+                    regressions += 1
+            print(line)
+    return regressions
+
+def _number(value):
+    return "-" if value is None else "{:.4g}".format(value)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the firmware against a simulated board")
+    parser.add_argument("--save", action="store_true", help="save the results as the baseline")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file to compare with or save to")
+    parser.add_argument("--check", type=float, metavar="PERCENT",
+                        help="exit with an error if any result is this much worse than the baseline")
+    args = parser.parse_args()
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = run_all()
+    regressions = report(results, baseline, args.check)
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print("saved baseline to", args.baseline)
+
+    if regressions:
+        print(regressions, "results regressed")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+The keyboard firmware: layers picked with a modifier and selector keys,
+actions from config.json, combos and the main loop. code.py imports this
+and calls `run()`, so this module can be shipped precompiled as
+firmware.mpy along with pmk (see tools/build_mpy.py) instead of being
+compiled from source on every boot. The settings below can be changed
+from code.py before calling `run()`, without rebuilding.
+"""
+
+import json
+import os
+import time
+from pmk import PMK, Governor, Profiler, MemoryMonitor, PRESS, RELEASE, HOLD, COMBO, COMBO_RELEASE
+from pmk.platform.keybow2040 import Keybow2040 as Hardware
+import usb_hid
+from adafruit_hid.keyboard import Keyboard
+from adafruit_hid.keyboard_layout_us import KeyboardLayoutUS
+from adafruit_hid.consumer_control import ConsumerControl
+from keymap import HID, Keymap, BinaryKeymap
+from scheduler import Scheduler
+
+# Set to True to run scanning, LEDs and HID output as separate asyncio
+# tasks (see pmk.runtime) instead of the single loop in `run()`
+ASYNC_RUNTIME = False
+
+# Strings are typed with up to this many keys pressed in each keyboard
+# report, at no more than MAX_REPORT_RATE reports a second (None for as
+# fast as the host polls). 1 rolls from key to key, pressing each
+# character in the report that releases the one before, so characters
+# arrive in order at about one report each; only repeated keys and
+# modifier changes take an extra report. Higher packs characters into
+# shared reports, but the order of keys within a report means nothing to
+# the host, so some hosts will type them out of order.
+KEYS_PER_REPORT = 1
+MAX_REPORT_RATE = None
+
+# The key held to pick a layer, and the keys that pick each layer (a
+# layer's number is its selector key's number). Every other key belongs
+# to the current layer, however many keys the board has.
+MODIFIER_KEY = 0
+SELECTOR_KEYS = range(1, 9)
+
+# Set to False to scan at full rate all the time, instead of polling less
+# often while the keys are idle and turning the LEDs off while the
+# computer is asleep
+POWER_SAVING = True
+
+# With POWER_SAVING, after this many milliseconds without a key press the
+# LEDs are powered down and the board light sleeps until a key is pressed.
+# Off (None) by default, so the LEDs stay lit; to turn it on, set e.g.
+# firmware.DEEP_IDLE_TIME = 300000 in code.py for five minutes.
+DEEP_IDLE_TIME = None
+
+# Set to True to time every frame; type "p" on the serial console to
+# print a summary
+PROFILE = False
+
+# Set to True to print how much each frame allocates on the serial
+# console every 10000 frames
+MONITOR_MEMORY = False
+
+# Milliseconds from code.py starting, and from power on, to the first
+# switch scan, set by `run()`
+startup_time = None
+boot_time = None
+
+# Load the keymap. The configurator writes a compact config.bin next to
+# config.json, which is read one layer at a time; config.json is used if
+# it is missing or isn't the config.json it was built from.
+def exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+def load_keymap(num_keys, layout):
+    if exists("/config.bin"):
+        try:
+            keymap = BinaryKeymap("/config.bin", num_keys, layout, KEYS_PER_REPORT)
+            if keymap.built_from("/config.json"):
+                return keymap
+        except Exception as e:
+            print("Failed to load config.bin:", e)
+
+    try:
+        with open("/config.json") as f:
+            return Keymap(json.load(f), num_keys, layout, KEYS_PER_REPORT)
+    except Exception as e:
+        print("Failed to load config.json:", e)
+        while True:
+            pass  # Freeze if config fails to load
+
+# Set LEDs for the selected layer
+def set_layer_leds(layer):
+    for i in content_keys:
+        if layer is None:
+            keys[i].led_off()
+        else:
+            keys[i].set_led(*layer.colors[i])
+
+# Show the layer selectors while the modifier is held, otherwise
+# show the current layer dimmed on its selector key
+def set_selector_leds(selecting):
+    if selecting:
+        modifier.led_off()  # Turn off modifier LED
+        for i in selectors:
+            # Only show layer selector if the layer exists in config
+            if i in keymap:
+                keys[i].set_led(*keymap.color(i))
+            else:
+                keys[i].led_off()
+    else:
+        for i in selectors:
+            if i == current_layer and layer is not None:
+                # Show current layer with a dim indicator
+                keys[i].set_led(*layer.dim_color)
+            else:
+                keys[i].led_off()  # Turn off other layer selector LEDs
+        modifier.set_led(0, 255, 0)  # Green LED for modifier when not held
+
+# Handle a press of a key on the current layer. Every key is pressed and
+# released independently, so any number can be held at once.
+def press_key(number):
+    global held_mask
+    action = layer.actions[number] if layer is not None else None
+    if action is None:
+        return
+    try:
+        action.press(scheduler)
+        held_actions[number] = action
+        held_mask |= 1 << number
+    except Exception as e:
+        print("Error handling key", number, e)
+
+def release_key(number):
+    global held_mask
+    if not held_mask & (1 << number):
+        return
+    held_mask &= ~(1 << number)
+    action = held_actions[number]
+    held_actions[number] = None
+    try:
+        action.release(scheduler)
+    except Exception as e:
+        print("Error releasing key", number, e)
+
+# Handle a key event from keybow.events()
+def handle_event(event, number, timestamp):
+    global selecting, current_layer, layer
+
+    if event == COMBO:
+        try:
+            combo_actions[number].press(scheduler)
+        except Exception as e:
+            print("Error handling combo", number, e)
+    elif event == COMBO_RELEASE:
+        try:
+            combo_actions[number].release(scheduler)
+        except Exception as e:
+            print("Error releasing combo", number, e)
+    elif number == modifier.number:
+        # Holding the modifier shows the layer selectors
+        if event == HOLD:
+            selecting = True
+            set_selector_leds(True)
+        elif event == RELEASE and selecting:
+            selecting = False
+            set_selector_leds(False)
+    elif event == RELEASE:
+        release_key(number)
+    elif event != PRESS:
+        return
+    elif selecting and number in selectors:
+        if number in keymap:
+            current_layer = number
+            layer = keymap.load(number)
+            set_layer_leds(layer)  # Update LEDs for the new layer
+    else:
+        press_key(number)
+
+def setup():
+    # Creates the board, HID devices and keymap from the settings, and
+    # lights the starting layer. Everything the functions above use is
+    # kept in this module's globals.
+
+    global keybow, keys, scheduler, keymap, modifier, selectors, content_keys
+    global current_layer, layer, selecting, combo_actions, held_mask, held_actions
+
+    keybow = PMK(Hardware())
+    if POWER_SAVING:
+        keybow.governor = Governor()
+        keybow.deep_idle_time = DEEP_IDLE_TIME
+    if PROFILE:
+        keybow.profiler = Profiler()
+    if MONITOR_MEMORY:
+        keybow.memory = MemoryMonitor(report_every=10000)
+    keys = keybow.keys
+    keyboard = Keyboard(usb_hid.devices)
+    layout = KeyboardLayoutUS(keyboard)
+    consumer = ConsumerControl(usb_hid.devices)
+    hid = HID(keyboard, consumer, layout)
+    # Actions run through the scheduler a step at a time, so app launches
+    # and typing never block the main loop
+    scheduler = Scheduler(hid, max_report_rate=MAX_REPORT_RATE)
+    keymap = load_keymap(len(keys), layout)
+
+    # Key setup
+    modifier = keys[MODIFIER_KEY]
+    selectors = {i: keys[i] for i in SELECTOR_KEYS if i < len(keys)}
+    content_keys = [i for i in range(len(keys)) if i != MODIFIER_KEY and i not in selectors]
+    current_layer = 1
+    layer = keymap.load(current_layer) if current_layer in keymap else None
+    selecting = False
+
+    # Combos from config.json apply on every layer; keybow numbers them in
+    # the order they're added, matching this list, so a combo keybow turns
+    # down is left out of both
+    combo_actions = []
+    for numbers, window, action in keymap.combos:
+        try:
+            keybow.add_combo(numbers, window)
+        except ValueError as e:
+            print("Error adding combo {}: {}".format(numbers, e))
+            continue
+        combo_actions.append(action)
+
+    # Keys whose actions are held down, as a bitmask, and the action each
+    # one pressed, so it is released even if the layer changed in between
+    held_mask = 0
+    held_actions = [None] * len(keys)
+
+    # Initialize LEDs for the starting layer
+    set_layer_leds(layer)
+    set_selector_leds(False)
+
+def run(started=None):
+    # Sets up and runs the firmware; doesn't return. `started` is
+    # time.monotonic_ns() at the top of code.py, for reporting how long
+    # startup took.
+
+    global startup_time, boot_time
+
+    setup()
+
+    # Scan once, then report how long it took to get here over serial.
+    # time.monotonic_ns() counts from power on, so after a reload (saving
+    # a file to the drive) boot_time includes the previous runs.
+    keybow.update()
+    now = time.monotonic_ns()
+    boot_time = now // 1000000
+    if started is not None:
+        startup_time = (now - started) // 1000000
+    print("First scan {} ms after code.py started, {} ms after power on".format(startup_time, boot_time))
+
+    if ASYNC_RUNTIME:
+        # Scan, LED refresh and HID output each run as their own task
+        import asyncio
+        from pmk.runtime import Runtime
+
+        runtime = Runtime(keybow)
+
+        async def hid_task():
+            while runtime.running:
+                scheduler.update()
+                if scheduler.busy():
+                    keybow.keep_awake()
+                await asyncio.sleep(0 if scheduler.busy() else 0.001)
+
+        asyncio.run(runtime.run(handle_event, hid_task()))
+
+    # Main loop
+    while True:
+        keybow.update()
+
+        # Only do work when a key has changed state. Checking the queue
+        # first saves creating the events() generator on frames with
+        # nothing to do. With the default polled scanning a press has to
+        # last a few scans to get through the debouncer; only the keypad
+        # backend (Hardware(background_scan=True)) also queues presses that
+        # start and end between two iterations.
+        if len(keybow.event_queue):
+            for event, number, timestamp in keybow.events():
+                handle_event(event, number, timestamp)
+
+        # Advance any running actions, staying at full rate until they finish
+        scheduler.update(keybow.ticks)
+        if scheduler.busy():
+            keybow.keep_awake()
+
+        # Print the profile when it's asked for over serial
+        if PROFILE:
+            keybow.profiler.poll_serial()
@@ -0,0 +1,411 @@
+import struct
+
+try:
+    from binascii import crc32
+except ImportError:
+    crc32 = None
+
+from adafruit_hid.keycode import Keycode
+from adafruit_hid.consumer_control_code import ConsumerControlCode
+
+from scheduler import PRESS, RELEASE_ALL, TAP, WAIT, TYPE, TYPE_KEYS, ROLL_KEYS
+from typer import pack_string
+
+# Binary keymap format written by the configurator to config.bin. All
+# values are little-endian:
+#   header:  magic "KBKM", version, number of keys, number of layers,
+#            number of combos, size and CRC-32 of the config.json it was
+#            built from
+#   index:   per layer: number, r, g, b, file offset, size, record count
+#   combos:  per combo: number of keys, window in ms, the key numbers,
+#            then a record (key 0)
+#   records: per key: key number, kind, r, g, b, payload length, payload
+# A code record's payload is the UTF-8 "code" value from config.json; an
+# app record's payload is the shortcut, then a NUL and the command if any.
+_MAGIC = b"KBKM"
+_VERSION = 3
+_HEADER = "<4sBBBBII"
+_HEADER_SIZE = 16
+_INDEX = "<BBBBIHH"
+_INDEX_SIZE = 12
+_RECORD = "<BBBBBH"
+_RECORD_SIZE = 7
+_COMBO = "<BH"
+_COMBO_SIZE = 3
+_KIND_CODE = 1
+_KIND_APP = 2
+
+# Short names accepted in shortcuts such as "CTRL+C" or "WIN+R".
+_ALIASES = {
+    "CTRL": "CONTROL",
+    "WIN": "WINDOWS",
+}
+
+class HID:
+    """
+    The HID devices that actions send their reports to.
+    """
+    def __init__(self, keyboard, consumer, layout):
+        self.keyboard = keyboard
+        self.consumer = consumer
+        self.layout = layout
+
+class Action:
+    """
+    Something a key does when pressed, with the colour its LED shows. By
+    default the output is precompiled into a sequence of scheduler steps,
+    queued on press.
+
+    :param color: (r, g, b) tuple for the key's LED
+    """
+    def __init__(self, color, steps=()):
+        self.color = color
+        self.steps = steps
+
+    def press(self, scheduler):
+        scheduler.add(self.steps)
+
+    def release(self, scheduler):
+        pass
+
+class KeycodeAction(Action):
+    """
+    Presses one or more keycodes together, e.g. "A" or "CTRL+C", holding
+    them down until the key is released. They are pressed with
+    `Scheduler.hold()` rather than queued as steps: straight away, unless a
+    running action is holding a shortcut down.
+    """
+    def __init__(self, keycodes, color):
+        super().__init__(color)
+        self.keycodes = keycodes
+
+    def press(self, scheduler):
+        scheduler.hold(self.keycodes)
+
+    def release(self, scheduler):
+        scheduler.unhold(self.keycodes)
+
+class ConsumerAction(Action):
+    """
+    Sends a consumer control code, e.g. "VOLUME_INCREMENT", held until the
+    key is released. It's sent straight away rather than queued as steps.
+    """
+    def __init__(self, code, color):
+        super().__init__(color)
+        self.code = code
+
+    def press(self, scheduler):
+        scheduler.hid.consumer.press(self.code)
+
+    def release(self, scheduler):
+        scheduler.hid.consumer.release()
+
+class StringAction(Action):
+    """
+    Types a string.
+    """
+    def __init__(self, text, color, layout=None, keys_per_report=1):
+        super().__init__(color, (type_step(text, layout, keys_per_report),))
+        self.text = text
+
+class AppAction(Action):
+    """
+    Launches an app by pressing a shortcut (e.g. WIN+R), then optionally
+    typing a command and pressing enter.
+    """
+    def __init__(self, shortcut, command, color, layout=None, keys_per_report=1):
+        steps = []
+        if shortcut:
+            steps.append((PRESS, shortcut))
+            steps.append((WAIT, 100))  # Hold for a moment
+            steps.append((RELEASE_ALL, None))
+        if command is not None:
+            if shortcut:
+                steps.append((WAIT, 500))  # Wait for dialog to open
+            steps.append(type_step(command, layout, keys_per_report))
+            steps.append((TAP, (Keycode.ENTER,)))
+        super().__init__(color, tuple(steps))
+        self.shortcut = shortcut
+        self.command = command
+
+class Layer:
+    """
+    A compiled layer: one action slot per key, indexed by key number,
+    with every colour worked out up front.
+    """
+    def __init__(self, number, name, color, actions):
+        self.number = number
+        self.name = name
+        self.color = color
+        self.dim_color = tuple(c // 4 for c in color)
+        self.actions = actions
+        self.colors = [(0, 0, 0) if a is None else a.color for a in actions]
+
+def type_step(text, layout=None, keys_per_report=1):
+    # Returns the scheduler step that types `text`: precompiled into keycode
+    # groups if there's a layout that can type every character, otherwise
+    # typed through the layout a character at a time. With one key per
+    # report each character rolls over from the one before; with more,
+    # characters are packed into shared reports.
+
+    if layout is not None:
+        try:
+            if keys_per_report == 1:
+                return (ROLL_KEYS, pack_string(text, layout, 1))
+            return (TYPE_KEYS, pack_string(text, layout, keys_per_report))
+        except ValueError:
+            pass
+    return (TYPE, text)
+
+def parse_keycodes(text, layout=None):
+    # Returns a tuple of keycodes for a "+" separated shortcut such as
+    # "CTRL+ALT+T", or None if any part isn't a key. Single characters that
+    # aren't Keycode names (e.g. "1" or "/") are looked up in the layout.
+
+    keycodes = []
+    for part in text.split("+"):
+        name = part.strip().upper()
+        name = _ALIASES.get(name, name)
+        if name and hasattr(Keycode, name):
+            codes = (getattr(Keycode, name),)
+        elif len(name) == 1 and layout is not None:
+            try:
+                codes = layout.keycodes(part.strip())
+            except ValueError:
+                return None
+        else:
+            return None
+        for code in codes:
+            if code not in keycodes:
+                keycodes.append(code)
+    return tuple(keycodes)
+
+def parse_shortcut(text, layout=None):
+    # Returns the keycodes for an app action's shortcut, or () if it has
+    # none. Raises ValueError if any part isn't a key, rather than
+    # launching the app without it.
+
+    if not text.strip():
+        return ()
+    keycodes = parse_keycodes(text, layout)
+    if not keycodes:
+        raise ValueError("unknown key in shortcut {!r}".format(text))
+    return keycodes
+
+def is_shortcut(text):
+    # Returns True if a "+" separated value names at least one key longer
+    # than a single character, e.g. "CTRL+C" or "F5+1". Values made only of
+    # single characters, such as "1+1" or "a+b", are text to type.
+
+    for part in text.split("+"):
+        name = part.strip().upper()
+        name = _ALIASES.get(name, name)
+        if len(name) > 1 and hasattr(Keycode, name):
+            return True
+    return False
+
+def compile_action(value, color, layout=None, keys_per_report=1):
+    # Turns one key's config entry into an Action. `color` is the layer's
+    # colour, used if the key doesn't have its own. `keys_per_report` is
+    # the most keys pressed together when typing strings; 1 presses a
+    # character per report, in order.
+
+    if isinstance(value, dict):
+        color = tuple(value.get("color", color))
+        if value.get("type") == "app":
+            shortcut = parse_shortcut(value.get("shortcut", ""), layout)
+            return AppAction(shortcut, value.get("command"), color, layout, keys_per_report)
+        value = value.get("code", "")
+
+    if not isinstance(value, str):
+        raise ValueError("unsupported key value {!r}".format(value))
+
+    if hasattr(Keycode, value):
+        return KeycodeAction((getattr(Keycode, value),), color)
+    if hasattr(ConsumerControlCode, value):
+        return ConsumerAction(getattr(ConsumerControlCode, value), color)
+    if "+" in value and is_shortcut(value):
+        keycodes = parse_keycodes(value, layout)
+        if keycodes:
+            return KeycodeAction(keycodes, color)
+    # Anything else is typed as a plain string
+    return StringAction(value, color, layout, keys_per_report)
+
+def compile_layer(number, layer_conf, num_keys, layout=None, keys_per_report=1):
+    # Compiles a layer's config into a Layer with a fixed slot per key.
+
+    color = tuple(layer_conf.get("color", [0, 0, 255]))
+    actions = [None] * num_keys
+    for k, v in layer_conf.get("keys", {}).items():
+        try:
+            actions[int(k)] = compile_action(v, color, layout, keys_per_report)
+        except Exception as e:
+            print("Error compiling key {} of layer {}: {}".format(k, number, e))
+    return Layer(number, layer_conf.get("name", ""), color, actions)
+
+def compile_layers(config, num_keys, layout=None, keys_per_report=1):
+    # Compiles every layer in a loaded config.json into a dict of Layers
+    # keyed by layer number.
+
+    layers = {}
+    for n, layer_conf in config.get("layers", {}).items():
+        try:
+            number = int(n)
+        except ValueError:
+            print("Skipping layer with non-numeric id:", n)
+            continue
+        layers[number] = compile_layer(number, layer_conf, num_keys, layout, keys_per_report)
+    return layers
+
+def compile_combos(config, layout=None, keys_per_report=1):
+    # Compiles the "combos" list of a loaded config.json into a list of
+    # (key numbers, window in milliseconds, Action) tuples. Each combo is a key
+    # entry with its "keys" and an optional "window" in milliseconds, e.g.
+    # {"keys": [14, 15], "code": "CTRL+Z", "window": 50}
+
+    combos = []
+    for combo in config.get("combos", []):
+        try:
+            numbers = tuple(int(k) for k in combo["keys"])
+            window = int(combo.get("window", 50))
+            action = compile_action(combo, (0, 0, 0), layout, keys_per_report)
+            combos.append((numbers, window, action))
+        except Exception as e:
+            print("Error compiling combo {}: {}".format(combo, e))
+    return combos
+
+def file_signature(path, chunk=256):
+    # Returns the size and CRC-32 of a file, or None if it doesn't exist.
+    # The CRC is 0 if binascii.crc32 isn't available.
+
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return None
+    size = 0
+    crc = 0
+    buffer = bytearray(chunk)
+    with f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            size += n
+            if crc32 is not None:
+                crc = crc32(memoryview(buffer)[:n], crc)
+    return size, crc
+
+class Keymap:
+    """
+    Keymap compiled from a loaded config.json, with every layer held in
+    memory. `combos` apply on every layer.
+    """
+    def __init__(self, config, num_keys, layout=None, keys_per_report=1):
+        self._layers = compile_layers(config, num_keys, layout, keys_per_report)
+        self.numbers = sorted(self._layers)
+        self.combos = compile_combos(config, layout, keys_per_report)
+
+    def __contains__(self, number):
+        return number in self._layers
+
+    def color(self, number):
+        return self._layers[number].color
+
+    def load(self, number):
+        return self._layers[number]
+
+class BinaryKeymap:
+    """
+    Keymap compiled by the configurator into a binary file. Only the
+    header, layer index and combos are kept in memory; each layer's
+    records are read from flash when it is loaded.
+
+    :param path: path of the binary keymap, e.g. "/config.bin"
+    """
+    def __init__(self, path, num_keys, layout=None, keys_per_report=1):
+        self._path = path
+        self._num_keys = num_keys
+        self._layout = layout
+        self._keys_per_report = keys_per_report
+        self._index = {}
+        self.combos = []
+
+        with open(path, "rb") as f:
+            header = f.read(_HEADER_SIZE)
+            if len(header) != _HEADER_SIZE:
+                raise ValueError("truncated keymap header")
+            magic, version, _, count, combos, size, crc = struct.unpack(_HEADER, header)
+            if magic != _MAGIC or version != _VERSION:
+                raise ValueError("not a version {} keymap".format(_VERSION))
+            self.source = (size, crc)
+
+            index = f.read(_INDEX_SIZE * count)
+            if len(index) != _INDEX_SIZE * count:
+                raise ValueError("truncated keymap index")
+            for i in range(count):
+                number, r, g, b, offset, size, records = struct.unpack_from(_INDEX, index, i * _INDEX_SIZE)
+                self._index[number] = ((r, g, b), offset, size)
+
+            for i in range(combos):
+                size, window = struct.unpack(_COMBO, f.read(_COMBO_SIZE))
+                numbers = tuple(f.read(size))
+                _, kind, r, g, b, length = struct.unpack(_RECORD, f.read(_RECORD_SIZE))
+                payload = f.read(length).decode()
+                try:
+                    action = self._decode(kind, (r, g, b), payload)
+                    self.combos.append((numbers, window, action))
+                except Exception as e:
+                    print("Error loading combo {}: {}".format(numbers, e))
+
+        self.numbers = sorted(self._index)
+
+    def __contains__(self, number):
+        return number in self._index
+
+    def built_from(self, path):
+        # Returns True if this keymap was built from the file at `path`,
+        # e.g. "/config.json", going by its size and CRC-32, or if there's
+        # no such file. Modification times aren't used, as copying an older
+        # file onto the drive can keep its original time.
+
+        source = file_signature(path)
+        if source is None:
+            return True
+        if crc32 is None:
+            return source[0] == self.source[0]
+        return source == self.source
+
+    def color(self, number):
+        return self._index[number][0]
+
+    def load(self, number):
+        # Reads and compiles a single layer's records from flash.
+
+        color, offset, size = self._index[number]
+        with open(self._path, "rb") as f:
+            f.seek(offset)
+            data = f.read(size)
+
+        actions = [None] * self._num_keys
+        pos = 0
+        while pos + _RECORD_SIZE <= len(data):
+            key, kind, r, g, b, length = struct.unpack_from(_RECORD, data, pos)
+            pos += _RECORD_SIZE
+            payload = data[pos:pos + length].decode()
+            pos += length
+            try:
+                actions[key] = self._decode(kind, (r, g, b), payload)
+            except Exception as e:
+                print("Error loading key {} of layer {}: {}".format(key, number, e))
+
+        return Layer(number, "", color, actions)
+
+    def _decode(self, kind, color, payload):
+        # Turns a record's kind and payload into an Action.
+
+        if kind == _KIND_APP:
+            parts = payload.split("\0", 1)
+            shortcut = parse_shortcut(parts[0], self._layout)
+            command = parts[1] if len(parts) > 1 else None
+            return AppAction(shortcut, command, color, self._layout, self._keys_per_report)
+        return compile_action(payload, color, self._layout, self._keys_per_report)
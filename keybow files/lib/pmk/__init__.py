@@ -50,60 +50,362 @@ For Pico RGB Keypad Base:
 
 import time
 
+from .ticks import ticks_ms, ticks_add, ticks_diff, TICKS_MAX_AGE
+from .combos import Combos
+from .debounce import Debouncer
+from .events import EventQueue, PRESS, RELEASE, HOLD, COMBO, COMBO_RELEASE
+from .framebuffer import Framebuffer
+from .geometry import Grid
+from .profiler import Profiler, WAIT, READ, KEYS, LEDS
+from .memory import MemoryMonitor
+from .governor import Governor
+
 class PMK(object):
     """
     Represents a set of Key instances with
     associated LEDs and key behaviours.
 
+    The clock is read once per `update()` and every time (event timestamps,
+    hold, sleep and combo timing) is in wrapping integer milliseconds from
+    `ticks_ms()`, compared with `ticks_diff()`; the current frame's time is
+    `ticks`. Settings keep their units from before, though: `led_sleep_time`
+    and each key's `hold_time` are set in seconds, and converted to
+    milliseconds once when set.
+
+    Set `governor` to a `Governor` to have `update()` pace itself, scanning
+    and refreshing LEDs less often while the keys are idle or the USB host
+    is suspended. Without one, `update()` runs as often as it is called.
+
+    Set `deep_idle_time` to a number of milliseconds to power the LEDs down
+    in hardware once nothing has happened for that long, and put the board
+    into light sleep until a switch is pressed, where the switches can wake
+    it. LED changes made meanwhile are kept and written in one go on wake.
+
+    Set `profiler` to a `Profiler` to time each stage of every frame run
+    by `update()`; `profiler.dump()` prints a summary. Set `memory` to a
+    `MemoryMonitor` to count what each frame allocates. With no key
+    changing state, `update()` allocates nothing.
+
     :param hardware: object representing a board hardware
+    :param event_queue_size: number of key events buffered between calls
+                             to `events()` before the oldest are dropped
+    :param debounce_samples: number of consecutive scans a switch must read
+                             the same before its state changes (unused
+                             with switches that debounce themselves)
     """
-    def __init__(self, hardware):
+    def __init__(self, hardware, event_queue_size=32, debounce_samples=4):
         self.hardware = hardware
         self.keys = []
-        self.time_of_last_press = time.monotonic()
+        self.ticks = ticks_ms()
+        self.time_of_last_press = self.ticks
         self.time_since_last_press = None
         self.led_sleep_enabled = False
         self.led_sleep_time = 60
         self.sleeping = False
         self.was_asleep = False
-        self.last_led_states = None
+        self._lit_before_sleep = 0
         self.rotation = 0
+        self.switch_states = 0
+        self.held_states = 0
+        self.event_queue = EventQueue(event_queue_size)
+        self.debouncer = Debouncer(debounce_samples)
+        self.framebuffer = Framebuffer(self.hardware.num_keys())
+        self.combos = None
+        self.governor = None
+        self.last_activity = self.ticks
+        self._last_flush = self.ticks
+        self.deep_idle_time = None
+        self.profiler = None
+        self.memory = None
+        self.deep_idle = False
+        self._queued = self.hardware.queues_events()
+        self.grid = Grid(*self.hardware.grid_size())
 
         for i in range(self.hardware.num_keys()):
-            _key = Key(i, self.hardware)
+            _key = Key(i, self.hardware, self.framebuffer, self.grid.width)
             self.keys.append(_key)
 
+        # Keys indexed by hardware number, which unlike `keys` is not
+        # reordered by `rotate()`.
+        self._hw_keys = list(self.keys)
+
     def update(self):
         # Call this in each iteration of your while loop to update
         # to update everything's state, e.g. `keybow.update()`
 
-        for _key in self.keys:
-            _key.update()
+        governor = self.governor
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.frame()
+        if self.memory is not None:
+            self.memory.update()
+
+        if governor is None:
+            self.scan()
+            self.flush()
+        else:
+            # Wait out the rest of the governor's scan interval, so the scan
+            # happens as late as possible and sees the freshest switch
+            # states.
+            delay = governor.scan_interval - ticks_diff(ticks_ms(), self.ticks)
+            if delay > 0:
+                time.sleep(delay / 1000)
+
+            self.scan()
+
+            # Push any LEDs that changed out to the hardware, at the
+            # governor's LED rate. A negative time since the last flush
+            # means it was so long ago, e.g. before days of light sleep,
+            # that the ticks have wrapped.
+            since_flush = ticks_diff(self.ticks, self._last_flush)
+            if since_flush < 0 or since_flush >= governor.led_interval:
+                self.flush()
+                self._last_flush = self.ticks
+
+        if profiler is not None:
+            profiler.mark(LEDS)
+
+    @property
+    def led_sleep_time(self):
+        # Seconds without a press before the LEDs sleep, if
+        # `led_sleep_enabled`.
+
+        return self._led_sleep_ticks / 1000
+
+    @led_sleep_time.setter
+    def led_sleep_time(self, seconds):
+        self._led_sleep_ticks = round(seconds * 1000)
+
+    def keep_awake(self):
+        # Counts this frame as activity, holding the governor at full rate,
+        # e.g. while actions are still being typed out.
+
+        self.last_activity = self.ticks
+
+    def scan(self):
+        # Reads the switches and updates the keys, events and LED sleep
+        # state, without writing LEDs to the hardware. `update()` does this
+        # followed by `flush()`; call them separately to run scanning and
+        # LED refresh at different rates.
+
+        profiler = self.profiler
+        if profiler is not None:
+            profiler.mark(WAIT)
+
+        update_time = ticks_ms()
+        self.ticks = update_time
+        if self._queued:
+            # The switches are scanned and debounced in the background, so
+            # just take every transition queued since the last scan.
+            changed = self._read_queued()
+            states = raw = self.switch_states
+        else:
+            # Read every switch in one go, rather than once per key, and
+            # debounce the whole scan at once.
+            raw = self.hardware.read_all()
+            changed = self.debouncer.update(raw)
+            states = self.debouncer.state
+        self.switch_states = states
+        if profiler is not None:
+            profiler.mark(READ)
+
+        # Any switch reading pressed, even one still being debounced, or
+        # changing state counts as activity and puts the governor back to
+        # full rate.
+        if raw | states | changed:
+            self.last_activity = update_time
+        idle = ticks_diff(update_time, self.last_activity)
+        if idle > TICKS_MAX_AGE:
+            self.last_activity = ticks_add(update_time, -TICKS_MAX_AGE)
+            idle = TICKS_MAX_AGE
+        if self.governor is not None:
+            self.governor.update(idle)
+
+        # Only keys that are pressed or have just been released have any
+        # state to update; idle keys are skipped.
+        active = states | changed
+        idx = 0
+        while active:
+            if active & 1:
+                self._hw_keys[idx].update((states >> idx) & 1, update_time)
+            active >>= 1
+            idx += 1
+
+        # Queue press and release events for every key whose state changed
+        # since the last scan (queued switches have done this already), and
+        # a hold event for each pressed key that has just crossed its
+        # `hold_time`.
+        if changed and not self._queued:
+            self._queue_events(changed, states, update_time)
+
+        self.held_states &= states
+        unheld = states & ~self.held_states
+        idx = 0
+        while unheld:
+            if unheld & 1:
+                _key = self._hw_keys[idx]
+                if _key.held:
+                    self.held_states |= 1 << idx
+                    self._push(HOLD, _key.number, update_time)
+            unheld >>= 1
+            idx += 1
+
+        if self.combos is not None:
+            self.combos.update(update_time, self.event_queue)
 
         # Used to work out the sleep behaviour, by keeping track
         # of the time of the last key press.
         if self.any_pressed():
-            self.time_of_last_press = time.monotonic()
-            self.sleeping = False
-
-        self.time_since_last_press = time.monotonic() - self.time_of_last_press
+            self.time_of_last_press = update_time
 
-        # If LED sleep is enabled, but not engaged, check if enough time
-        # has elapsed to engage sleep. If engaged, record the state of the
-        # LEDs, so it can be restored on wake.
-        if self.led_sleep_enabled and not self.sleeping:
-            if time.monotonic() - self.time_of_last_press > self.led_sleep_time:
-                self.sleeping = True
-                self.last_led_states = [k.rgb if k.lit else [0, 0, 0] for k in self.keys]
-                self.set_all(0, 0, 0)
-                self.was_asleep = True
+        since_press = ticks_diff(update_time, self.time_of_last_press)
+        if since_press > TICKS_MAX_AGE:
+            self.time_of_last_press = ticks_add(update_time, -TICKS_MAX_AGE)
+            since_press = TICKS_MAX_AGE
+        self.time_since_last_press = since_press
+
+        # The LEDs sleep while the USB host is suspended, or, if LED sleep
+        # is enabled, once enough time has elapsed since the last press.
+        should_sleep = self.governor is not None and self.governor.suspended
+        if self.led_sleep_enabled and self.time_since_last_press > self._led_sleep_ticks:
+            should_sleep = True
+
+        # If sleep isn't engaged yet, record which LEDs are lit, so they
+        # can be turned back on, with the colours keys keep in `rgb`, on
+        # wake.
+        if should_sleep and not self.sleeping:
+            self.sleeping = True
+            lit = 0
+            for _key in self._hw_keys:
+                if _key.lit:
+                    lit |= 1 << _key.hw_number
+            self._lit_before_sleep = lit
+            self.set_all(0, 0, 0)
+            self.was_asleep = True
+        elif not should_sleep:
+            self.sleeping = False
 
         # If it was sleeping, but is no longer, then restore LED states.
         if not self.sleeping and self.was_asleep:
-            for k in range(len(self.keys)):
-                self.keys[k].set_led(*self.last_led_states[k])
+            for _key in self._hw_keys:
+                if self._lit_before_sleep & (1 << _key.hw_number):
+                    _key.led_on()
             self.was_asleep = False
 
+        # Leave deep idle as soon as a switch reads pressed, or enter it
+        # once there's been no activity for `deep_idle_time`.
+        if self.deep_idle:
+            if self.last_activity == update_time:
+                self._wake()
+        elif self.deep_idle_time is not None:
+            if idle > self.deep_idle_time:
+                self._deep_sleep()
+
+        if profiler is not None:
+            profiler.mark(KEYS)
+
+    def _deep_sleep(self):
+        # Powers the LEDs down in hardware, then light sleeps until a switch
+        # is pressed if the switches support it. Either way the next scan
+        # that sees a switch pressed wakes everything back up.
+
+        self.flush()
+        self.deep_idle = True
+        self.hardware.sleep(True)
+        self.hardware.light_sleep()
+
+    def _wake(self):
+        # Powers the LEDs back up and redraws the whole framebuffer, with
+        # any changes made while asleep, in a single write.
+
+        self.deep_idle = False
+        self.hardware.sleep(False)
+        self.framebuffer.invalidate()
+        self.flush()
+
+    def flush(self):
+        # Writes LEDs that have changed since the last flush to the hardware.
+        # This is called at the end of `update()`, so is only needed to show
+        # changes made outside of the main loop straight away. Nothing is
+        # written while in deep idle.
+
+        if not self.deep_idle:
+            self.framebuffer.flush(self.hardware)
+
+    def _read_queued(self):
+        # Drains the switches' own event queue, pushing a press or release
+        # event with its original timestamp for every transition, so ones
+        # that start and end between two scans still get through. Updates
+        # `switch_states` and returns the bits that changed.
+
+        states = self.switch_states
+        changed = 0
+        event = self.hardware.read_event()
+        while event is not None:
+            idx, pressed, timestamp = event
+            bit = 1 << idx
+            if pressed:
+                states |= bit
+            else:
+                states &= ~bit
+            changed |= bit
+            self._push(PRESS if pressed else RELEASE, self._hw_keys[idx].number, timestamp)
+            event = self.hardware.read_event()
+        self.switch_states = states
+        return changed
+
+    def _queue_events(self, changed, states, timestamp):
+        # Pushes a press or release event for each set bit of `changed`.
+
+        idx = 0
+        while changed:
+            if changed & 1:
+                if states & (1 << idx):
+                    event = PRESS
+                else:
+                    event = RELEASE
+                self._push(event, self._hw_keys[idx].number, timestamp)
+            changed >>= 1
+            idx += 1
+
+    def _push(self, event, number, timestamp):
+        # Queues an event, passing it through the combo matcher if there
+        # are any combos.
+
+        if self.combos is None:
+            self.event_queue.push(event, number, timestamp)
+        else:
+            self.combos.process(event, number, timestamp, self.event_queue)
+
+    def add_combo(self, numbers, window=50):
+        # Adds a combo: a set of key numbers that, pressed together within
+        # `window` milliseconds, produce a single COMBO event instead of their
+        # own presses, and a COMBO_RELEASE when the first is let go. Returns
+        # the combo's number, which is the `number` of those events. Combos
+        # can have up to six keys (`combos.MAX_KEYS`).
+
+        # combo = keybow.add_combo([13, 14])
+        # for event, number, timestamp in keybow.events():
+        #     if event == COMBO and number == combo:
+        #         do something
+
+        if self.combos is None:
+            self.combos = Combos()
+        return self.combos.add(numbers, window)
+
+    def events(self):
+        # Drains the event queue, yielding an (event, number, timestamp)
+        # tuple for each press, release or hold since the last call, oldest
+        # first. `event` is one of `PRESS`, `RELEASE` or `HOLD` and `number`
+        # is the key's (rotated) number. Use it as follows:
+
+        # for event, number, timestamp in keybow.events():
+        #     if event == PRESS:
+        #         do something
+
+        while len(self.event_queue):
+            yield self.event_queue.pop()
+
     def set_led(self, number, r, g, b):
         # Set an individual key's LED to an RGB value by its number.
 
@@ -123,31 +425,27 @@ class PMK(object):
         # Returns a Boolean list of Keybow's key states
         # (0=not pressed, 1=pressed).
 
-        _states = [_key.state for _key in self.keys]
+        states = self.switch_states
+        _states = [(states >> _key.hw_number) & 1 for _key in self.keys]
         return _states
 
     def get_pressed(self):
         # Returns a list of key numbers currently pressed.
 
-        _pressed = [_key.number for _key in self.keys if _key.state == True]
+        states = self.switch_states
+        _pressed = [_key.number for _key in self.keys if states & (1 << _key.hw_number)]
         return _pressed
 
     def any_pressed(self):
         # Returns True if any key is pressed, False if none are pressed.
 
-        if any(self.get_states()):
-            return True
-        else:
-            return False
+        return self.switch_states != 0
 
     def none_pressed(self):
         # Returns True if none of the keys are pressed, False is any key
         # is pressed.
 
-        if not any(self.get_states()):
-            return True
-        else:
-            return False
+        return self.switch_states == 0
 
     def on_press(self, _key, handler=None):
         # Attaches a press function to a key, via a decorator. This is stored as
@@ -225,26 +523,21 @@ class PMK(object):
 
         # Rotate as follows: `keybow.rotate(270)`
 
-        old_rotation = self.rotation
-        self.rotation += degrees
-        num_rotations = (round(self.rotation / 90) - round(old_rotation / 90)) % 4
+        # The grid works out the numbering for every rotation up front, so
+        # this only hands out numbers; the switch and LED paths keep using
+        # each key's hardware number and don't change at all.
 
-        if num_rotations == 0:
-            return
-
-        matrix = [[(x * 4) + y for y in range(4)] for x in range(4)]
-
-        for r in range(num_rotations):
-            matrix = zip(*matrix[::-1])
-            matrix = [list(x) for x in list(matrix)]
-
-        flat_matrix = [x for y in matrix for x in y]
+        self.rotation += degrees
+        turns = round(self.rotation / 90) % 4
+        numbers = self.grid.rotations[turns]
+        width = self.grid.size(turns)[0]
 
-        for i in range(len(self.keys)):
-            self.keys[i].number = flat_matrix[i]
-            self.keys[i].update_xy()
+        for _key in self._hw_keys:
+            _key.number = numbers[_key.hw_number]
+            _key.width = width
+            _key.update_xy()
 
-        self.keys = sorted(self.keys, key=lambda x:x.number)
+        self.keys = [self._hw_keys[hw] for hw in self.grid.inverse[turns]]
 
 
 class Key:
@@ -252,23 +545,38 @@ class Key:
     Represents a key on Keybow 2040, with associated switch and
     LED behaviours.
 
-    :param number: the key number (0-15) to associate with the key
+    :param number: the key number to associate with the key
     :param hardware:  object representing a board hardware
+    :param framebuffer: optional Framebuffer that LED changes are written
+                        to, instead of straight to the hardware
+    :param width: width of the grid of keys, for working out x/y
+
+    Keys use `__slots__` to keep their footprint small; whether keys are
+    pressed or held is also kept as bitmasks by PMK.
     """
-    def __init__(self, number, hardware):
+    __slots__ = (
+        "hardware", "framebuffer", "number", "hw_number", "width", "x", "y",
+        "state", "pressed", "last_state", "time_of_last_press",
+        "time_held_for", "held", "_hold_ticks", "modifier", "rgb", "lit",
+        "press_function", "release_function", "hold_function",
+        "press_func_fired", "hold_func_fired",
+    )
+
+    def __init__(self, number, hardware, framebuffer=None, width=4):
         self.hardware = hardware
+        self.framebuffer = framebuffer
         self.number = number
         self.hw_number = number
+        self.width = width
         self.state = 0
         self.pressed = 0
-        self.last_state = None
-        self.time_of_last_press = time.monotonic()
-        self.time_since_last_press = None
+        self.last_state = False
+        self.time_of_last_press = ticks_ms()
         self.time_held_for = 0
         self.held = False
         self.hold_time = 0.75
         self.modifier = False
-        self.rgb = [0, 0, 0]
+        self.rgb = (0, 0, 0)
         self.lit = False
         self.led_off()
         self.press_function = None
@@ -276,8 +584,6 @@ class Key:
         self.hold_function = None
         self.press_func_fired = False
         self.hold_func_fired = False
-        self.debounce = 0.125
-        self.key_locked = False
         self.update_xy()
 
     def get_state(self):
@@ -285,28 +591,27 @@ class Key:
 
         return int(self.hardware.switch_state(self.hw_number))
 
-    def update(self):
+    def update(self, state=None, update_time=None):
         # Updates the state of the key and updates all of its
-        # attributes.
+        # attributes. `state` is this key's bit from the bulk switch
+        # read done in `PMK.update()`, and `update_time` that frame's
+        # `ticks_ms()`; if omitted, the switch and clock are read
+        # directly.
 
-        self.time_since_last_press = time.monotonic() - self.time_of_last_press
+        if update_time is None:
+            update_time = ticks_ms()
 
-        # Keys get locked during the debounce time.
-        if self.time_since_last_press < self.debounce:
-            self.key_locked = True
-        else:
-            self.key_locked = False
+        if state is None:
+            state = self.get_state()
 
-        self.state = self.get_state()
+        self.state = state
         self.pressed = self.state
-        update_time = time.monotonic()
 
         # If there's a `press_function` attached, then call it,
         # returning the key object and the pressed state.
-        if self.press_function is not None and self.pressed and not self.press_func_fired and not self.key_locked:
+        if self.press_function is not None and self.pressed and not self.press_func_fired:
             self.press_function(self)
             self.press_func_fired = True
-            # time.sleep(0.05)  # A little debounce
 
         # If the key has been pressed and releases, then call
         # the `release_function`, if one is attached.
@@ -329,13 +634,13 @@ class Key:
         # If the key is pressed and held, then update the
         # `time_held_for` variable.
         elif self.pressed and self.last_state == True:
-            self.time_held_for = update_time - self.time_of_last_press
+            self.time_held_for = ticks_diff(update_time, self.time_of_last_press)
             self.last_state = True
 
         # If the `hold_time` theshold is crossed, then call the
         # `hold_function` if one is attached. The `hold_func_fired`
         # ensures that the function is only called once.
-        if self.time_held_for > self.hold_time:
+        if self.time_held_for > self._hold_ticks:
             self.held = True
             if self.hold_function is not None and not self.hold_func_fired:
                 self.hold_function(self)
@@ -344,17 +649,34 @@ class Key:
             self.held = False
             self.hold_func_fired = False
 
+    @property
+    def hold_time(self):
+        # Seconds a key has to be held down for to count as held.
+
+        return self._hold_ticks / 1000
+
+    @hold_time.setter
+    def hold_time(self, seconds):
+        self._hold_ticks = round(seconds * 1000)
+
+    @property
+    def time_since_last_press(self):
+        return ticks_diff(ticks_ms(), self.time_of_last_press)
+
+    @property
+    def xy(self):
+        return (self.x, self.y)
+
     def update_xy(self):
-        self.xy = self.get_xy()
-        self.x, self.y = self.xy
+        self.x, self.y = self.get_xy()
 
     def get_xy(self):
-        # Returns the x/y coordinate of a key from 0,0 to 3,3.
+        # Returns the x/y coordinate of a key, from 0,0 at the top left.
 
-        return number_to_xy(self.number)
+        return number_to_xy(self.number, self.width)
 
     def get_number(self):
-        # Returns the key number, from 0 to 15.
+        # Returns the key number, from 0 to one less than the number of keys.
 
         return self.number
 
@@ -370,13 +692,17 @@ class Key:
     def set_led(self, r, g, b):
         # Set this key's LED to an RGB value.
 
-        if [r, g, b] == [0, 0, 0]:
+        if r == 0 and g == 0 and b == 0:
             self.lit = False
         else:
             self.lit = True
-            self.rgb = [r, g, b]
+            self.rgb = (r, g, b)
 
-        self.hardware.set_pixel(self.hw_number, r, g, b)
+        if self.framebuffer is not None:
+            self.framebuffer.set_pixel(self.hw_number, r, g, b)
+        else:
+            self.hardware.set_pixel(self.hw_number, r, g, b)
+            self.hardware.show()
 
     def led_on(self):
         # Turn the LED on, using its current RGB value.
@@ -417,14 +743,14 @@ class Key:
         # When printed, show the key's state (0 or 1).
         return self.state
 
-def xy_to_number(x, y):
+def xy_to_number(x, y, width=4):
     # Convert an x/y coordinate to key number.
-    return x + (y * 4)
+    return x + (y * width)
 
-def number_to_xy(number):
+def number_to_xy(number, width=4):
     # Convert a number to an x/y coordinate.
-    x = number % 4
-    y = number // 4
+    x = number % width
+    y = number // width
 
     return (x, y)
 
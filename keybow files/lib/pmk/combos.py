@@ -0,0 +1,126 @@
+from .ticks import ticks_diff
+from .events import PRESS, RELEASE, COMBO, COMBO_RELEASE
+
+# Most keys a combo can have. Every subset of a combo's keys gets an entry
+# in the table of partial combos, so each key more doubles its size.
+MAX_KEYS = 6
+
+class Combos:
+    """
+    Turns sets of keys pressed together within a short window into single
+    combo events. Combos are kept in a table keyed by their key bitmask,
+    along with every partial set of keys that could still grow into one,
+    so matching is a dictionary lookup however many combos there are.
+    Presses are only held back while they could still become a combo, and
+    for no longer than its window; every other key passes straight
+    through.
+    """
+    def __init__(self):
+        self._combos = {}
+        self._windows = []
+        self._partial = {}
+        self._active = []
+        self._pending = 0
+        self._pending_presses = []
+        self._pending_since = None
+        self._consumed = 0
+
+    def add(self, numbers, window=50):
+        # Adds a combo of the given key numbers, which must all be pressed
+        # within `window` milliseconds of the first. Returns the combo's number,
+        # used in its COMBO and COMBO_RELEASE events. Raises ValueError if
+        # there are more than MAX_KEYS keys.
+
+        mask = 0
+        count = 0
+        for number in numbers:
+            if not mask & (1 << number):
+                count += 1
+            mask |= 1 << number
+        if count > MAX_KEYS:
+            raise ValueError("combos can have at most {} keys".format(MAX_KEYS))
+
+        combo = len(self._windows)
+        self._combos[mask] = combo
+        self._windows.append(window)
+        self._active.append(0)
+
+        # Every strict, non-empty subset of the keys can still grow into
+        # this combo, so presses matching one are held back.
+        subset = (mask - 1) & mask
+        while subset:
+            self._partial[subset] = max(self._partial.get(subset, 0), window)
+            subset = (subset - 1) & mask
+
+        return combo
+
+    def process(self, event, number, timestamp, queue):
+        # Filters an event from the scan into `queue`.
+
+        bit = 1 << number
+
+        if event == PRESS:
+            if not self._matches(self._pending | bit):
+                self._flush(queue)
+            if self._matches(self._pending | bit):
+                if not self._pending:
+                    self._pending_since = timestamp
+                self._pending |= bit
+                self._pending_presses.append((number, timestamp))
+                # A complete combo that no bigger combo starts with fires
+                # straight away.
+                if self._pending not in self._partial:
+                    self._fire(timestamp, queue)
+            else:
+                queue.push(PRESS, number, timestamp)
+
+        elif event == RELEASE:
+            if self._pending & bit:
+                self._resolve(timestamp, queue)
+            if self._consumed & bit:
+                self._consumed &= ~bit
+                for combo in range(len(self._active)):
+                    if self._active[combo] & bit:
+                        self._active[combo] = 0
+                        queue.push(COMBO_RELEASE, combo, timestamp)
+            else:
+                queue.push(RELEASE, number, timestamp)
+
+        elif not (self._pending | self._consumed) & bit:
+            queue.push(event, number, timestamp)
+
+    def update(self, now, queue):
+        # Resolves pending presses once their window has passed. Call once
+        # per scan.
+
+        if self._pending:
+            window = self._partial.get(self._pending)
+            if window is None:
+                window = self._windows[self._combos[self._pending]]
+            if ticks_diff(now, self._pending_since) >= window:
+                self._resolve(now, queue)
+
+    def _matches(self, mask):
+        return mask in self._partial or mask in self._combos
+
+    def _resolve(self, timestamp, queue):
+        if self._pending in self._combos:
+            self._fire(timestamp, queue)
+        else:
+            self._flush(queue)
+
+    def _fire(self, timestamp, queue):
+        combo = self._combos[self._pending]
+        self._active[combo] = self._pending
+        self._consumed |= self._pending
+        self._pending = 0
+        self._pending_presses = []
+        queue.push(COMBO, combo, timestamp)
+
+    def _flush(self, queue):
+        # Passes held back presses on as ordinary presses.
+
+        for number, timestamp in self._pending_presses:
+            queue.push(PRESS, number, timestamp)
+        self._pending = 0
+        self._pending_presses = []
@@ -0,0 +1,41 @@
+class Debouncer:
+    """
+    Debounces a bitmask of switch states, all bits at once. A bit only
+    changes once it has read the same for `samples` consecutive scans,
+    so bounce is filtered in a few scan periods without any per-key timers.
+
+    :param samples: number of consecutive matching scans needed for a
+                    switch to change state (1 disables debouncing)
+    """
+    def __init__(self, samples=4):
+        self._samples = max(1, samples)
+        self._history = [0] * self._samples
+        self._idx = 0
+        self.state = 0
+
+    def update(self, raw):
+        # Adds a raw scan bitmask and returns the bits that changed state
+        # with this scan; the debounced bitmask is left in `state`. Nothing
+        # is allocated, so this can run every scan.
+
+        history = self._history
+        history[self._idx] = raw
+        self._idx = (self._idx + 1) % self._samples
+
+        # Bits set in every sample are stable pressed, bits clear in
+        # every sample are stable released; the rest keep their old state.
+        stable_high = raw
+        any_high = raw
+        for sample in history:
+            stable_high &= sample
+            any_high |= sample
+
+        state = (self.state | stable_high) & any_high
+        changed = state ^ self.state
+        self.state = state
+        return changed
+
+    def reset(self, state=0):
+        for i in range(self._samples):
+            self._history[i] = state
+        self.state = state
@@ -0,0 +1,55 @@
+PRESS = 1
+RELEASE = 2
+HOLD = 3
+COMBO = 4          # number is the combo's number, from PMK.add_combo()
+COMBO_RELEASE = 5  # sent when the first of a combo's keys is released
+
+class EventQueue:
+    """
+    Fixed-size ring buffer of timestamped key events. Events are stored as
+    (event, number, timestamp) in preallocated slots; when the buffer is
+    full the oldest event is overwritten and counted in `dropped`.
+
+    :param size: maximum number of events held before the oldest is dropped
+    """
+    def __init__(self, size=32):
+        self._size = size
+        self._events = bytearray(size)
+        self._numbers = bytearray(size)
+        self._times = [0] * size
+        self._head = 0
+        self._count = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._count
+
+    def push(self, event, number, timestamp):
+        # Appends an event, overwriting the oldest one if the buffer is full.
+
+        if self._count == self._size:
+            self._head = (self._head + 1) % self._size
+            self._count -= 1
+            self.dropped += 1
+
+        idx = (self._head + self._count) % self._size
+        self._events[idx] = event
+        self._numbers[idx] = number
+        self._times[idx] = timestamp
+        self._count += 1
+
+    def pop(self):
+        # Removes and returns the oldest event as an (event, number,
+        # timestamp) tuple, or None if the buffer is empty.
+
+        if self._count == 0:
+            return None
+
+        idx = self._head
+        self._head = (self._head + 1) % self._size
+        self._count -= 1
+        return (self._events[idx], self._numbers[idx], self._times[idx])
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
@@ -0,0 +1,45 @@
+class Framebuffer:
+    """
+    Compact RGB framebuffer for a set of pixels. Pixels are stored as
+    consecutive r, g, b bytes, and a bitmask records which pixels have
+    changed since they were last flushed to the hardware.
+
+    :param count: number of pixels
+    """
+    def __init__(self, count):
+        self.count = count
+        self.buffer = bytearray(count * 3)
+        # Everything starts dirty, so the first flush puts the hardware
+        # into a known state.
+        self.dirty = (1 << count) - 1
+
+    def set_pixel(self, idx, r, g, b):
+        # Sets a pixel, only marking it dirty if its value actually changed.
+
+        buffer = self.buffer
+        i = idx * 3
+        if buffer[i] != r or buffer[i + 1] != g or buffer[i + 2] != b:
+            buffer[i] = r
+            buffer[i + 1] = g
+            buffer[i + 2] = b
+            self.dirty |= 1 << idx
+
+    def get_pixel(self, idx):
+        i = idx * 3
+        return self.buffer[i], self.buffer[i + 1], self.buffer[i + 2]
+
+    def invalidate(self):
+        # Marks every pixel dirty, e.g. after the hardware has been cleared.
+
+        self.dirty = (1 << self.count) - 1
+
+    def flush(self, hardware):
+        # Pushes the pixels that changed since the last flush to the
+        # hardware in one bulk update, then shows them.
+
+        if not self.dirty:
+            return
+
+        hardware.set_pixels(self.buffer, self.dirty)
+        hardware.show()
+        self.dirty = 0
@@ -0,0 +1,68 @@
+class Grid:
+    """
+    Layout of keys in a grid `width` keys wide and `height` high, numbered
+    left to right, top to bottom. The numbering after each quarter turn
+    of `PMK.rotate()` is worked out once, as permutation tuples, so a
+    rotated lookup is a single index.
+
+    :param width: number of columns
+    :param height: number of rows
+    """
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.count = width * height
+
+        # `rotations[r][n]` is the number key n has after r quarter turns,
+        # and `inverse[r][m]` is the key that ends up numbered m.
+        rotations = [tuple(range(self.count))]
+        w, h = width, height
+        for _ in range(3):
+            turn = tuple((w - 1 - n % w) * h + n // w for n in range(self.count))
+            rotations.append(tuple(turn[n] for n in rotations[-1]))
+            w, h = h, w
+        self.rotations = tuple(rotations)
+        self.inverse = tuple(invert(p) for p in rotations)
+
+    def size(self, rotation=0):
+        # Returns the (width, height) of the grid after `rotation` quarter
+        # turns.
+
+        if rotation % 2:
+            return self.height, self.width
+        return self.width, self.height
+
+def invert(permutation):
+    # Returns the permutation that undoes `permutation`.
+
+    inverse = [0] * len(permutation)
+    for i, n in enumerate(permutation):
+        inverse[n] = i
+    return tuple(inverse)
+
+def remap_tables(permutation):
+    # Returns lookup tables for `remap()` that move bit n of a mask to bit
+    # `permutation[n]`, one table per byte of the mask.
+
+    tables = []
+    for base in range(0, len(permutation), 8):
+        bits = permutation[base:base + 8]
+        table = []
+        for value in range(256):
+            mask = 0
+            for i, n in enumerate(bits):
+                if value & (1 << i):
+                    mask |= 1 << n
+            table.append(mask)
+        tables.append(tuple(table))
+    return tuple(tables)
+
+def remap(mask, tables):
+    # Permutes the bits of `mask` with tables from `remap_tables()`, a byte
+    # at a time.
+
+    result = 0
+    for table in tables:
+        result |= table[mask & 0xFF]
+        mask >>= 8
+    return result
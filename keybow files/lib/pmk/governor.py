@@ -0,0 +1,60 @@
+try:
+    import supervisor
+except ImportError:
+    supervisor = None
+
+def host_suspended():
+    # Returns True if the USB host has suspended or dropped the connection.
+    # Always False where this can't be told, e.g. off the board.
+
+    try:
+        return not supervisor.runtime.usb_connected
+    except AttributeError:
+        return False
+
+class Governor:
+    """
+    Picks how often PMK scans the switches and refreshes the LEDs from how
+    long the keys have been idle. It steps down to slower polling the
+    longer nothing happens, and goes straight back to full rate as soon as
+    a switch reads pressed, so debouncing and every event after the first
+    run at full rate. The first touch after a long idle is seen within one
+    idle scan interval.
+
+    :param levels: tuple of (idle ms, scan interval ms, LED interval ms),
+                   in order of increasing idle time; the first should
+                   start at 0
+    :param suspended: (scan interval ms, LED interval ms) used while the
+                      USB host is suspended
+    """
+    def __init__(self, levels=((0, 1, 16), (1000, 5, 33), (30000, 20, 100)), suspended=(100, 1000)):
+        self.levels = levels
+        self.suspended_intervals = suspended
+        self.level = 0
+        self.suspended = False
+        self.scan_interval = levels[0][1]
+        self.led_interval = levels[0][2]
+
+    def update(self, idle):
+        # Picks the intervals for a frame where the keys have been idle
+        # for `idle` milliseconds. Returns True if the intervals changed.
+
+        suspended = host_suspended()
+        if suspended:
+            level = -1
+            scan_interval, led_interval = self.suspended_intervals
+        else:
+            level = 0
+            levels = self.levels
+            while level + 1 < len(levels) and idle >= levels[level + 1][0]:
+                level += 1
+            _, scan_interval, led_interval = levels[level]
+
+        self.suspended = suspended
+        if level == self.level:
+            return False
+
+        self.level = level
+        self.scan_interval = scan_interval
+        self.led_interval = led_interval
+        return True
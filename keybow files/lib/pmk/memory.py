@@ -0,0 +1,57 @@
+import gc
+
+class MemoryMonitor:
+    """
+    Tracks heap allocation per frame from `gc.mem_free()`, and counts
+    garbage collections, seen as the free heap growing. Set `PMK.memory`
+    to one and it's updated at the start of every frame. A steady-state
+    frame (no key changing state) should allocate nothing, so any bytes
+    counted while idle point to a regression.
+
+    :param report_every: frames between summaries printed to the serial
+                         console, or None to only print from `dump()`
+    """
+    def __init__(self, report_every=None):
+        self.report_every = report_every
+        self.frames = 0
+        self.allocated = 0
+        self.allocating_frames = 0
+        self.collections = 0
+        self.available = hasattr(gc, "mem_free")
+        self._free = gc.mem_free() if self.available else 0
+
+    def update(self):
+        # Counts what was allocated since the last call. Frames a collection
+        # ran in are counted as collections, since what they allocated
+        # can't be told apart from what was freed.
+
+        if not self.available:
+            return
+
+        free = gc.mem_free()
+        if free > self._free:
+            self.collections += 1
+        elif free < self._free:
+            self.allocated += self._free - free
+            self.allocating_frames += 1
+        self._free = free
+        self.frames += 1
+
+        if self.report_every and self.frames % self.report_every == 0:
+            self.dump()
+
+    def reset(self):
+        self.frames = 0
+        self.allocated = 0
+        self.allocating_frames = 0
+        self.collections = 0
+
+    def dump(self):
+        # Prints a summary to the serial console.
+
+        if not self.available:
+            print("gc.mem_free() isn't available")
+            return
+        per_frame = self.allocated // self.frames if self.frames else 0
+        print("frames {}, {} bytes/frame, {} frames allocated, {} collections, {} bytes free".format(
+            self.frames, per_frame, self.allocating_frames, self.collections, self._free))
@@ -8,11 +8,38 @@ class PMK:
     def set_pixel(self, idx, r, g, b):
         self._display.set_pixel(idx, r, g, b)
 
+    def set_pixels(self, buffer, mask=None):
+        self._display.set_pixels(buffer, mask)
+
+    def show(self):
+        self._display.show()
+
+    def sleep(self, sleeping):
+        self._display.sleep(sleeping)
+
+    def light_sleep(self):
+        return self._switches.light_sleep()
+
     def num_keys(self):
         return self._switches.num_switches()
 
+    def grid_size(self):
+        # Returns the (width, height) of the grid of keys. Boards that
+        # aren't a single row should override this.
+
+        return self.num_keys(), 1
+
     def switch_state(self, idx):
         return self._switches.switch_state(idx)
 
+    def read_all(self):
+        return self._switches.read_all()
+
+    def queues_events(self):
+        return self._switches.queues_events()
+
+    def read_event(self):
+        return self._switches.read_event()
+
     def i2c(self):
         return self._i2c
@@ -4,3 +4,27 @@ class Display:
     """
     def set_pixel(self, idx, r, g, b):
         raise NotImplementedError
+
+    def set_pixels(self, buffer, mask=None):
+        # Sets many pixels from a buffer of consecutive r, g, b bytes. Only
+        # pixels whose bit is set in `mask` need updating (all of them if
+        # it's None). Backends that can write a whole frame at once should
+        # override this.
+
+        for idx in range(len(buffer) // 3):
+            if mask is None or mask & (1 << idx):
+                i = idx * 3
+                self.set_pixel(idx, buffer[i], buffer[i + 1], buffer[i + 2])
+
+    def show(self):
+        # Makes pixels set since the last call visible, for backends that
+        # buffer their writes.
+
+        pass
+
+    def sleep(self, sleeping):
+        # Turns the LEDs off in hardware, keeping their pixels, or back on.
+        # Waking doesn't redraw anything; write a frame straight after.
+        # Backends that can power down should override this.
+
+        pass
@@ -4,10 +4,26 @@ from . import Display
 
 class Dotstar(Display):
     """
-    Display consisting of dotstars
+    Display consisting of dotstars. Pixel writes are buffered and only sent
+    to the strip, in one SPI burst, by `show()`.
     """
     def __init__(self, clock, data, count):
-        self._pixels = adafruit_dotstar.DotStar(clock, data, count)
+        self._pixels = adafruit_dotstar.DotStar(clock, data, count, auto_write=False)
+        self._brightness = self._pixels.brightness
 
     def set_pixel(self, idx, r, g, b):
         self._pixels[idx] = (r, g, b)
+
+    def show(self):
+        self._pixels.show()
+
+    def sleep(self, sleeping):
+        # DotStars have no shutdown mode, so sleeping sends a frame at
+        # zero global brightness; waking only restores the brightness.
+
+        if sleeping:
+            self._brightness = self._pixels.brightness
+            self._pixels.brightness = 0
+            self._pixels.show()
+        else:
+            self._pixels.brightness = self._brightness
@@ -1,13 +1,145 @@
 from adafruit_is31fl3731.keybow2040 import Keybow2040 as Pixels
 
 from . import Display
+from ...geometry import Grid
+
+# Writing a frame number to the command register selects that frame's bank,
+# whose PWM registers then start at 0x24 and auto-increment on writes.
+_COMMAND_REGISTER = 0xFD
+_COLOR_OFFSET = 0x24
+_NUM_LEDS = 144
 
 class Keybow2040(Display):
     """
-    Keybow 2040 4x4 display
+    Keybow 2040 4x4 display. Bulk updates only write the PWM registers of
+    pixels that changed, as one block spanning them, or register by register
+    when a few far apart pixels changed and that's fewer bytes on the bus.
+
+    :param double_buffer: if True, bulk updates are written to a hidden
+                          frame of the IS31FL3731 and shown by flipping
+                          frames in `show()`, so a repaint never tears
     """
-    def __init__(self, i2c):
+    def __init__(self, i2c, double_buffer=False):
         self._pixels = Pixels(i2c)
+        self._double_buffer = double_buffer
+        self._front = 0
+        self._flip = False
+
+        # Shadow copy of a frame bank's PWM registers, prefixed with the
+        # register address so it can be written in a single block.
+        self._frame = bytearray(_NUM_LEDS + 1)
+        self._frame[0] = _COLOR_OFFSET
+        self._bank = bytearray(2)
+        self._bank[0] = _COMMAND_REGISTER
+        self._register = bytearray(2)
+
+        # Span of `_frame` offsets, first and last, that each frame bank
+        # hasn't been written since they changed. Both start out covering
+        # everything, as the banks' contents are unknown.
+        self._missing = [1, _NUM_LEDS, 1, _NUM_LEDS]
+
+        # Offsets into `_frame` of each key's red, green and blue LEDs. The
+        # driver numbers the LEDs a quarter turn round from the keys.
+        leds = Grid(4, 4).rotations[1]
+        self._offsets = tuple(tuple(1 + Pixels.pixel_addr(led, c) for c in range(3)) for led in leds)
+        self._spans = tuple((min(o), max(o)) for o in self._offsets)
 
     def set_pixel(self, idx, r, g, b):
+        ro, go, bo = self._offsets[idx]
+        self._frame[ro] = r
+        self._frame[go] = g
+        self._frame[bo] = b
         self._pixels.pixelrgb(idx % 4, idx // 4, r, g, b)
+
+    def set_pixels(self, buffer, mask=None):
+        frame = self._frame
+        lo = _NUM_LEDS + 1
+        hi = 0
+        count = 0
+        for idx in range(len(self._offsets)):
+            if mask is None or mask & (1 << idx):
+                ro, go, bo = self._offsets[idx]
+                i = idx * 3
+                frame[ro] = buffer[i]
+                frame[go] = buffer[i + 1]
+                frame[bo] = buffer[i + 2]
+                first, last = self._spans[idx]
+                if first < lo:
+                    lo = first
+                if last > hi:
+                    hi = last
+                count += 1
+        if not count:
+            return
+
+        # Both banks are now missing this span, until they're written.
+        missing = self._missing
+        for b in (0, 2):
+            if lo < missing[b]:
+                missing[b] = lo
+            if hi > missing[b + 1]:
+                missing[b + 1] = hi
+
+        if self._double_buffer:
+            self._write_frame(self._front ^ 1)
+            self._flip = True
+        elif (mask is not None and 9 * count < hi - lo + 3
+              and missing[self._front * 2] == lo and missing[self._front * 2 + 1] == hi):
+            # Each register written alone takes 3 bytes on the bus, against
+            # 2 plus one a register for the span.
+            self._write_registers(self._front, mask)
+        else:
+            self._write_frame(self._front)
+
+    def show(self):
+        if self._flip:
+            self._front ^= 1
+            # Also makes the driver's own pixel writes target the new frame.
+            self._pixels.frame(self._front, show=True)
+            self._flip = False
+
+    def sleep(self, sleeping):
+        # Software shutdown stops the IS31FL3731 driving the LEDs, while
+        # its registers keep their values.
+
+        self._pixels.sleep(sleeping)
+
+    def _write_frame(self, bank):
+        # Writes the span of PWM registers a frame bank is missing in one
+        # transaction. The byte before the span is swapped for its register
+        # address while it's written, so nothing is copied.
+
+        missing = self._missing
+        lo = missing[bank * 2]
+        hi = missing[bank * 2 + 1]
+        if lo > hi:
+            return
+        start = lo - 1
+        frame = self._frame
+        saved = frame[start]
+        frame[start] = _COLOR_OFFSET + start
+        self._bank[1] = bank
+        with self._pixels.i2c_device as i2c:
+            i2c.write(self._bank)
+            i2c.write(frame, start=start, end=hi + 1)
+        frame[start] = saved
+        missing[bank * 2] = _NUM_LEDS + 1
+        missing[bank * 2 + 1] = 0
+
+    def _write_registers(self, bank, mask):
+        # Writes the red, green and blue registers of each pixel in `mask`
+        # to a frame bank one at a time.
+
+        frame = self._frame
+        register = self._register
+        self._bank[1] = bank
+        with self._pixels.i2c_device as i2c:
+            i2c.write(self._bank)
+            for idx in range(len(self._offsets)):
+                if mask & (1 << idx):
+                    for offset in self._offsets[idx]:
+                        register[0] = _COLOR_OFFSET + offset - 1
+                        register[1] = frame[offset]
+                        i2c.write(register)
+        self._missing[bank * 2] = _NUM_LEDS + 1
+        self._missing[bank * 2 + 1] = 0
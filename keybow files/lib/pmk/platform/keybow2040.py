@@ -1,6 +1,6 @@
 import board
 
-from .switches.gpio import GPIO as Switches
+from .switches.gpio import GPIO
 from .display.keybow2040 import Keybow2040 as Display
 
 from . import PMK
@@ -24,7 +24,22 @@ _PINS = [board.SW0,
         board.SW15]
 
 class Keybow2040(PMK):
-    def __init__(self):
+    """
+    :param double_buffer: if True, LED updates are double buffered
+    :param background_scan: if True, the switches are scanned and debounced
+                            in the background by the `keypad` module, so no
+                            presses are missed while the main loop is busy
+    """
+    def __init__(self, double_buffer=False, background_scan=False):
         self._i2c = board.I2C()
-        self._switches = Switches(_PINS)
-        self._display = Display(self._i2c)
+        if background_scan:
+            # Imported here so boards built without `keypad` can still use
+            # GPIO scanning.
+            from .switches.keypad import Keypad
+            self._switches = Keypad(_PINS)
+        else:
+            self._switches = GPIO(_PINS)
+        self._display = Display(self._i2c, double_buffer)
+
+    def grid_size(self):
+        return 4, 4
@@ -6,16 +6,16 @@ from .switches.tca9555 import TCA9555 as Switches
 from .display.dotstar import Dotstar as Display
 
 from . import PMK
+from ..geometry import Grid, remap_tables, remap
 
 NUM_KEYS = 16
 
-# Let's match Keybow2040 orientation
-_ROTATED = {
-    0:  12,  1:  8,  2: 4,  3: 0,
-    4:  13,  5:  9,  6: 5,  7: 1,
-    8:  14,  9: 10, 10: 6, 11: 2,
-    12: 15, 13: 11, 14: 7, 15: 3,
-}
+# Let's match Keybow2040 orientation: the keypad's switches and LEDs are
+# numbered a quarter turn round from Keybow 2040's. Switch reads are
+# permuted a byte at a time through lookup tables.
+_GRID = Grid(4, 4)
+_ROTATED = _GRID.rotations[1]
+_SWITCH_TABLES = remap_tables(_GRID.inverse[1])
 
 class RGBKeypadBase(PMK):
     def __init__(self):
@@ -27,11 +27,32 @@ class RGBKeypadBase(PMK):
         self._cs.value = 1
 
     def set_pixel(self, idx, r, g, b):
+        super().set_pixel(_ROTATED[idx], r, g, b)
+
+    def set_pixels(self, buffer, mask=None):
+        for idx in range(NUM_KEYS):
+            if mask is None or mask & (1 << idx):
+                i = idx * 3
+                self.set_pixel(idx, buffer[i], buffer[i + 1], buffer[i + 2])
+
+    def show(self):
         # https://github.com/pimoroni/pimoroni-pico/blob/main/libraries/pico_rgb_keypad/pico_rgb_keypad.cpp#L20-L45
-        # code above sets CS only for the time of updating LEDs, so let's do the same
+        # code above sets CS only for the time of updating LEDs, so let's do the same,
+        # once around the whole frame rather than per pixel
         self._cs.value = 0
-        super().set_pixel(_ROTATED[idx], r, g, b)
+        super().show()
+        self._cs.value = 1
+
+    def sleep(self, sleeping):
+        self._cs.value = 0
+        super().sleep(sleeping)
         self._cs.value = 1
 
     def switch_state(self, idx):
         return super().switch_state(_ROTATED[idx])
+
+    def read_all(self):
+        return remap(super().read_all(), _SWITCH_TABLES)
+
+    def grid_size(self):
+        return _GRID.size()
@@ -0,0 +1,365 @@
+"""
+Simulated board for running pmk and the firmware headless under CPython.
+
+A `Simulation` stands in for everything the firmware talks to: pmk's
+clock becomes a virtual one that only moves as the firmware scans and
+sleeps (including `asyncio.sleep()`, for the async runtime), the switches play back a `Timeline` of presses, the display
+records a timestamped copy of every frame shown, and stand-in `usb_hid`
+and `adafruit_hid` modules record every HID report. Runs are
+deterministic and go as fast as the host can run them. Run an unmodified
+code.py as follows, from the `lib` folder:
+
+    python -m pmk.platform.simulated ../code.py timeline.json --root ..
+"""
+
+import asyncio
+import builtins
+import json
+import os
+import sys
+import types
+
+import pmk
+
+from .. import PMK
+from ..switches import Switches
+from ..display import Display
+from . import hid
+
+_sleep = asyncio.sleep
+
+class SimulationEnd(Exception):
+    """
+    Raised by the simulated switches once the timeline has played out,
+    ending the firmware's main loop.
+    """
+
+class Clock:
+    """
+    Virtual clock standing in for the `time` module inside pmk. Time is
+    whole milliseconds in `ticks`, and only moves forward when advanced or
+    slept on.
+    """
+    def __init__(self, start=0):
+        self.ticks = start
+        self._sleepers = []
+
+    def monotonic_ns(self):
+        return self.ticks * 1000000
+
+    def monotonic(self):
+        return self.ticks / 1000
+
+    def sleep(self, seconds):
+        self.advance(round(seconds * 1000))
+
+    async def async_sleep(self, seconds, result=None):
+        # Stands in for `asyncio.sleep()`. Yields to the other tasks until
+        # the clock reaches the wake time, moving the clock on to it once
+        # no other task is due to wake sooner.
+
+        wake = self.ticks + max(0, round(seconds * 1000))
+        self._sleepers.append(wake)
+        try:
+            await _sleep(0)
+            while self.ticks < wake:
+                if wake == min(self._sleepers):
+                    self.advance(wake - self.ticks)
+                else:
+                    await _sleep(0)
+        finally:
+            self._sleepers.remove(wake)
+        return result
+
+    def advance(self, ms):
+        if ms > 0:
+            self.ticks += ms
+
+class Timeline:
+    """
+    Scripted switch activity, as (time ms, key number, pressed) steps in
+    time order, played back against the simulated clock until `end`.
+
+    :param steps: iterable of (time ms, key number, pressed) tuples
+    :param end: time the simulation stops at; defaults to one second
+                after the last step
+    """
+    def __init__(self, steps=(), end=None):
+        self.steps = []
+        self.end = 0
+        for step in steps:
+            self.add(*step)
+        if end is not None:
+            self.end = end
+
+    def add(self, time, number, pressed):
+        # Adds a step, keeping the steps in time order.
+
+        step = (time, number, bool(pressed))
+        idx = len(self.steps)
+        while idx > 0 and self.steps[idx - 1][0] > time:
+            idx -= 1
+        self.steps.insert(idx, step)
+        self.end = max(self.end, time + 1000)
+        return self
+
+    def tap(self, number, time, hold=50):
+        # Adds a press of a key at `time`, released `hold` ms later.
+
+        self.add(time, number, True)
+        return self.add(time + hold, number, False)
+
+    @classmethod
+    def load(cls, path):
+        # Loads a timeline saved by `save()`: a JSON object with "steps",
+        # a list of [time ms, key number, pressed] lists, and "end".
+
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["steps"], data.get("end"))
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({"steps": [[t, n, int(p)] for t, n, p in self.steps], "end": self.end}, f)
+
+class TimelineSwitches(Switches):
+    """
+    Switches that play back a Timeline. Every scan advances the clock by
+    `scan_time` ms, standing in for the time a frame takes on the board,
+    and calls `on_scan`, if given, with no arguments.
+    """
+    def __init__(self, timeline, count, clock, scan_time=1, on_scan=None):
+        self._timeline = timeline
+        self._count = count
+        self._clock = clock
+        self._scan_time = scan_time
+        self._on_scan = on_scan
+        self._next = 0
+        self._state = 0
+
+    def num_switches(self):
+        return self._count
+
+    def switch_state(self, idx):
+        return bool(self._state & (1 << idx))
+
+    def read_all(self):
+        if self._on_scan is not None:
+            self._on_scan()
+        self._clock.advance(self._scan_time)
+        now = self._clock.ticks
+        if now >= self._timeline.end:
+            raise SimulationEnd()
+
+        steps = self._timeline.steps
+        while self._next < len(steps) and steps[self._next][0] <= now:
+            _, number, pressed = steps[self._next]
+            if pressed:
+                self._state |= 1 << number
+            else:
+                self._state &= ~(1 << number)
+            self._next += 1
+        return self._state
+
+    def light_sleep(self):
+        # Skips the clock straight to the next press, or the end.
+
+        steps = self._timeline.steps
+        idx = self._next
+        while idx < len(steps) and not steps[idx][2]:
+            idx += 1
+        wake = steps[idx][0] if idx < len(steps) else self._timeline.end
+        self._clock.advance(wake - self._clock.ticks)
+        return True
+
+class RecordingDisplay(Display):
+    """
+    Display that keeps its pixels in a buffer and records a copy of it,
+    as a (time ms, bytes) tuple in `frames`, every time it is shown.
+    `writes` counts calls that wrote pixels.
+    """
+    def __init__(self, count, clock):
+        self._clock = clock
+        self.buffer = bytearray(count * 3)
+        self.frames = []
+        self.writes = 0
+        self.asleep = False
+
+    def set_pixel(self, idx, r, g, b):
+        i = idx * 3
+        self.buffer[i] = r
+        self.buffer[i + 1] = g
+        self.buffer[i + 2] = b
+        self.writes += 1
+
+    def set_pixels(self, buffer, mask=None):
+        for idx in range(len(self.buffer) // 3):
+            if mask is None or mask & (1 << idx):
+                i = idx * 3
+                self.buffer[i:i + 3] = buffer[i:i + 3]
+        self.writes += 1
+
+    def show(self):
+        self.frames.append((self._clock.ticks, bytes(self.buffer)))
+
+    def sleep(self, sleeping):
+        self.asleep = sleeping
+
+class Simulated(PMK):
+    """
+    Board with no hardware: switches from the simulation's timeline and a
+    display that records frames.
+
+    :param simulation: the Simulation this board belongs to
+    """
+    def __init__(self, simulation):
+        count = simulation.width * simulation.height
+        self._i2c = None
+        self._size = (simulation.width, simulation.height)
+        self._switches = TimelineSwitches(simulation.timeline, count, simulation.clock,
+                                          simulation.scan_time, simulation.on_scan)
+        self._display = RecordingDisplay(count, simulation.clock)
+        self.display = self._display
+
+    def grid_size(self):
+        return self._size
+
+class Simulation:
+    """
+    A headless run: the virtual clock, the timeline boards play back, the
+    HID devices reports are recorded on and the boards that were created.
+
+    :param timeline: Timeline of presses to play back
+    :param width: width of the simulated grid of keys
+    :param height: height of the simulated grid of keys
+    :param scan_time: virtual milliseconds each scan of the switches takes
+    :param on_scan: function called with no arguments at the start of
+                    every scan, e.g. to time frames
+    """
+    def __init__(self, timeline=None, width=4, height=4, scan_time=1, on_scan=None):
+        self.clock = Clock()
+        self.timeline = timeline if timeline is not None else Timeline()
+        self.width = width
+        self.height = height
+        self.scan_time = scan_time
+        self.on_scan = on_scan
+        self.namespace = None
+        self.keyboard = hid.Device("keyboard", 0x01, 0x06, self.clock)
+        self.consumer = hid.Device("consumer", 0x0C, 0x01, self.clock)
+        self.devices = [self.keyboard, self.consumer]
+        self.boards = []
+        self._saved = None
+
+    def board(self, *args, **kwargs):
+        # Creates a simulated board. Takes, and ignores, the arguments of
+        # the real platforms it stands in for.
+
+        board = Simulated(self)
+        self.boards.append(board)
+        return board
+
+    def install(self):
+        # Points pmk and `asyncio.sleep()` at the virtual clock and puts the
+        # stand-in modules in place of `usb_hid`, `adafruit_hid` and the
+        # board platforms, until `uninstall()`.
+
+        modules = {
+            "usb_hid": _module("usb_hid", devices=self.devices, Device=hid.Device),
+            "adafruit_hid": _module("adafruit_hid", find_device=hid.find_device),
+            "adafruit_hid.keycode": _module("adafruit_hid.keycode", Keycode=hid.Keycode),
+            "adafruit_hid.consumer_control_code": _module("adafruit_hid.consumer_control_code",
+                                                          ConsumerControlCode=hid.ConsumerControlCode),
+            "adafruit_hid.keyboard": _module("adafruit_hid.keyboard", Keyboard=hid.Keyboard),
+            "adafruit_hid.keyboard_layout_us": _module("adafruit_hid.keyboard_layout_us",
+                                                       KeyboardLayoutUS=hid.KeyboardLayoutUS),
+            "adafruit_hid.consumer_control": _module("adafruit_hid.consumer_control",
+                                                     ConsumerControl=hid.ConsumerControl),
+            "pmk.platform.keybow2040": _module("pmk.platform.keybow2040", Keybow2040=self.board),
+            "pmk.platform.rgbkeypadbase": _module("pmk.platform.rgbkeypadbase", RGBKeypadBase=self.board),
+        }
+        self._saved = (pmk.time, asyncio.sleep, {name: sys.modules.get(name) for name in modules})
+        pmk.time = pmk.ticks.time = self.clock
+        asyncio.sleep = self.clock.async_sleep
+        sys.modules.update(modules)
+
+    def uninstall(self):
+        if self._saved is None:
+            return
+        pmk.time, asyncio.sleep, modules = self._saved
+        pmk.ticks.time = pmk.time
+        for name, module in modules.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+        self._saved = None
+
+    def run(self, path, root=None):
+        # Runs a firmware script, e.g. code.py, until the timeline has
+        # played out. Top level files it opens by absolute path (such as
+        # "/config.json") are looked for in `root`, standing in for the
+        # CIRCUITPY drive, if given. The script's globals are kept in
+        # `namespace` afterwards. Modules the script imported from its own
+        # folder or `root`, such as firmware, are dropped from sys.modules
+        # afterwards, so the next run starts them afresh; others, such as
+        # the standard library, are kept. Returns the simulation.
+
+        modules = set(sys.modules)
+        folders = [os.path.dirname(os.path.abspath(path))]
+        if root is not None:
+            folders.append(os.path.abspath(root))
+        self.install()
+        _open, _stat = builtins.open, os.stat
+        if root is not None:
+            builtins.open = _rooted(_open, root)
+            os.stat = _rooted(_stat, root)
+        with open(path) as f:
+            code = compile(f.read(), path, "exec")
+        self.namespace = {"__name__": "__main__", "__file__": path}
+        try:
+            exec(code, self.namespace)
+        except SimulationEnd:
+            pass
+        finally:
+            builtins.open, os.stat = _open, _stat
+            self.uninstall()
+            for name in set(sys.modules) - modules:
+                if _inside(getattr(sys.modules[name], "__file__", None), folders):
+                    del sys.modules[name]
+        return self
+
+    def summary(self):
+        # Returns a short description of what the run produced.
+
+        lines = ["simulated {} ms".format(self.clock.ticks)]
+        for board in self.boards:
+            lines.append("{} frames shown, {} pixel writes".format(len(board.display.frames), board.display.writes))
+        for device in self.devices:
+            lines.append("{} {} reports".format(len(device.reports), device.name))
+        return "\n".join(lines)
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+def _inside(path, folders):
+    # Returns True if `path` is in one of `folders`, or below it.
+
+    if not path:
+        return False
+    path = os.path.abspath(path)
+    for folder in folders:
+        if os.path.commonpath([path, folder]) == folder:
+            return True
+    return False
+
+def _rooted(func, root):
+    # Wraps `open` or `os.stat` so top level absolute paths are resolved
+    # inside `root`.
+
+    def wrapper(path, *args, **kwargs):
+        if isinstance(path, str) and path.startswith("/") and os.path.dirname(path) == "/":
+            path = os.path.join(root, path[1:])
+        return func(path, *args, **kwargs)
+    return wrapper
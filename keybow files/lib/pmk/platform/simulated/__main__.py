@@ -0,0 +1,17 @@
+import argparse
+
+from . import Simulation, Timeline
+
+parser = argparse.ArgumentParser(description="Run firmware headless against a simulated board")
+parser.add_argument("script", help="firmware script to run, e.g. code.py")
+parser.add_argument("timeline", nargs="?", help="timeline JSON saved by Timeline.save()")
+parser.add_argument("--root", help="folder standing in for the CIRCUITPY drive")
+parser.add_argument("--end", type=int, help="milliseconds to run for")
+args = parser.parse_args()
+
+timeline = Timeline.load(args.timeline) if args.timeline else Timeline()
+if args.end is not None:
+    timeline.end = args.end
+
+simulation = Simulation(timeline).run(args.script, args.root)
+print(simulation.summary())
@@ -0,0 +1,303 @@
+# Stand-ins for `usb_hid` and the parts of `adafruit_hid` the firmware uses,
+# which send their reports to simulated devices that record them instead
+# of to a USB host. They behave like the real libraries as far as the
+# firmware can tell, including the six key limit of keyboard reports.
+
+class Device:
+    """
+    Simulated `usb_hid.Device` that records every report sent to it, as
+    (time ms, report bytes) tuples in `reports`.
+
+    :param name: name shown in summaries, e.g. "keyboard"
+    :param usage_page: HID usage page the libraries find the device by
+    :param usage: HID usage the libraries find the device by
+    :param clock: Clock the report times are read from
+    """
+    def __init__(self, name, usage_page, usage, clock):
+        self.name = name
+        self.usage_page = usage_page
+        self.usage = usage
+        self.clock = clock
+        self.reports = []
+
+    def send_report(self, report, report_id=None):
+        self.reports.append((self.clock.ticks, bytes(report)))
+
+def find_device(devices, usage_page, usage):
+    for device in devices:
+        if device.usage_page == usage_page and device.usage == usage:
+            return device
+    raise ValueError("Could not find matching HID device.")
+
+class Keycode:
+    """
+    USB HID keycodes, as in `adafruit_hid.keycode`.
+    """
+    A = 0x04
+    B = 0x05
+    C = 0x06
+    D = 0x07
+    E = 0x08
+    F = 0x09
+    G = 0x0A
+    H = 0x0B
+    I = 0x0C
+    J = 0x0D
+    K = 0x0E
+    L = 0x0F
+    M = 0x10
+    N = 0x11
+    O = 0x12
+    P = 0x13
+    Q = 0x14
+    R = 0x15
+    S = 0x16
+    T = 0x17
+    U = 0x18
+    V = 0x19
+    W = 0x1A
+    X = 0x1B
+    Y = 0x1C
+    Z = 0x1D
+    ONE = 0x1E
+    TWO = 0x1F
+    THREE = 0x20
+    FOUR = 0x21
+    FIVE = 0x22
+    SIX = 0x23
+    SEVEN = 0x24
+    EIGHT = 0x25
+    NINE = 0x26
+    ZERO = 0x27
+    ENTER = 0x28
+    RETURN = ENTER
+    ESCAPE = 0x29
+    BACKSPACE = 0x2A
+    TAB = 0x2B
+    SPACEBAR = 0x2C
+    SPACE = SPACEBAR
+    MINUS = 0x2D
+    EQUALS = 0x2E
+    LEFT_BRACKET = 0x2F
+    RIGHT_BRACKET = 0x30
+    BACKSLASH = 0x31
+    POUND = 0x32
+    SEMICOLON = 0x33
+    QUOTE = 0x34
+    GRAVE_ACCENT = 0x35
+    COMMA = 0x36
+    PERIOD = 0x37
+    FORWARD_SLASH = 0x38
+    CAPS_LOCK = 0x39
+    F1 = 0x3A
+    F2 = 0x3B
+    F3 = 0x3C
+    F4 = 0x3D
+    F5 = 0x3E
+    F6 = 0x3F
+    F7 = 0x40
+    F8 = 0x41
+    F9 = 0x42
+    F10 = 0x43
+    F11 = 0x44
+    F12 = 0x45
+    PRINT_SCREEN = 0x46
+    SCROLL_LOCK = 0x47
+    PAUSE = 0x48
+    INSERT = 0x49
+    HOME = 0x4A
+    PAGE_UP = 0x4B
+    DELETE = 0x4C
+    END = 0x4D
+    PAGE_DOWN = 0x4E
+    RIGHT_ARROW = 0x4F
+    LEFT_ARROW = 0x50
+    DOWN_ARROW = 0x51
+    UP_ARROW = 0x52
+    KEYPAD_NUMLOCK = 0x53
+    KEYPAD_FORWARD_SLASH = 0x54
+    KEYPAD_ASTERISK = 0x55
+    KEYPAD_MINUS = 0x56
+    KEYPAD_PLUS = 0x57
+    KEYPAD_ENTER = 0x58
+    KEYPAD_ONE = 0x59
+    KEYPAD_TWO = 0x5A
+    KEYPAD_THREE = 0x5B
+    KEYPAD_FOUR = 0x5C
+    KEYPAD_FIVE = 0x5D
+    KEYPAD_SIX = 0x5E
+    KEYPAD_SEVEN = 0x5F
+    KEYPAD_EIGHT = 0x60
+    KEYPAD_NINE = 0x61
+    KEYPAD_ZERO = 0x62
+    KEYPAD_PERIOD = 0x63
+    KEYPAD_BACKSLASH = 0x64
+    APPLICATION = 0x65
+    POWER = 0x66
+    KEYPAD_EQUALS = 0x67
+    F13 = 0x68
+    F14 = 0x69
+    F15 = 0x6A
+    F16 = 0x6B
+    F17 = 0x6C
+    F18 = 0x6D
+    F19 = 0x6E
+    F20 = 0x6F
+    F21 = 0x70
+    F22 = 0x71
+    F23 = 0x72
+    F24 = 0x73
+    LEFT_CONTROL = 0xE0
+    CONTROL = LEFT_CONTROL
+    LEFT_SHIFT = 0xE1
+    SHIFT = LEFT_SHIFT
+    LEFT_ALT = 0xE2
+    ALT = LEFT_ALT
+    OPTION = ALT
+    LEFT_GUI = 0xE3
+    GUI = LEFT_GUI
+    WINDOWS = GUI
+    COMMAND = GUI
+    RIGHT_CONTROL = 0xE4
+    RIGHT_SHIFT = 0xE5
+    RIGHT_ALT = 0xE6
+    RIGHT_GUI = 0xE7
+
+class ConsumerControlCode:
+    """
+    USB HID consumer control codes, as in
+    `adafruit_hid.consumer_control_code`.
+    """
+    RECORD = 0xB2
+    FAST_FORWARD = 0xB3
+    REWIND = 0xB4
+    SCAN_NEXT_TRACK = 0xB5
+    SCAN_PREVIOUS_TRACK = 0xB6
+    STOP = 0xB7
+    EJECT = 0xB8
+    PLAY_PAUSE = 0xCD
+    MUTE = 0xE2
+    VOLUME_DECREMENT = 0xEA
+    VOLUME_INCREMENT = 0xE9
+    BRIGHTNESS_DECREMENT = 0x70
+    BRIGHTNESS_INCREMENT = 0x6F
+
+class Keyboard:
+    """
+    Boot keyboard sending 8 byte reports: modifier bits, a reserved byte
+    and up to six pressed keys.
+    """
+    def __init__(self, devices):
+        self._device = find_device(devices, 0x01, 0x06)
+        self.report = bytearray(8)
+
+    def press(self, *keycodes):
+        for keycode in keycodes:
+            self._add(keycode)
+        self._device.send_report(self.report)
+
+    def release(self, *keycodes):
+        for keycode in keycodes:
+            self._remove(keycode)
+        self._device.send_report(self.report)
+
+    def release_all(self):
+        for i in range(8):
+            self.report[i] = 0
+        self._device.send_report(self.report)
+
+    def send(self, *keycodes):
+        self.press(*keycodes)
+        self.release_all()
+
+    def _add(self, keycode):
+        if keycode >= Keycode.LEFT_CONTROL:
+            self.report[0] |= 1 << (keycode - Keycode.LEFT_CONTROL)
+            return
+        keys = self.report
+        for i in range(2, 8):
+            if keys[i] == keycode:
+                return
+        for i in range(2, 8):
+            if keys[i] == 0:
+                keys[i] = keycode
+                return
+        raise ValueError("Trying to press more than six keys at once.")
+
+    def _remove(self, keycode):
+        if keycode >= Keycode.LEFT_CONTROL:
+            self.report[0] &= ~(1 << (keycode - Keycode.LEFT_CONTROL))
+            return
+        for i in range(2, 8):
+            if self.report[i] == keycode:
+                self.report[i] = 0
+
+# Characters typed with shift on a US layout, and the key each is on.
+_SHIFTED = {
+    "!": Keycode.ONE, "@": Keycode.TWO, "#": Keycode.THREE,
+    "$": Keycode.FOUR, "%": Keycode.FIVE, "^": Keycode.SIX,
+    "&": Keycode.SEVEN, "*": Keycode.EIGHT, "(": Keycode.NINE,
+    ")": Keycode.ZERO, "_": Keycode.MINUS, "+": Keycode.EQUALS,
+    "{": Keycode.LEFT_BRACKET, "}": Keycode.RIGHT_BRACKET,
+    "|": Keycode.BACKSLASH, ":": Keycode.SEMICOLON, '"': Keycode.QUOTE,
+    "~": Keycode.GRAVE_ACCENT, "<": Keycode.COMMA, ">": Keycode.PERIOD,
+    "?": Keycode.FORWARD_SLASH,
+}
+
+_UNSHIFTED = {
+    "\b": Keycode.BACKSPACE, "\t": Keycode.TAB, "\n": Keycode.ENTER,
+    "\x1b": Keycode.ESCAPE, " ": Keycode.SPACE, "-": Keycode.MINUS,
+    "=": Keycode.EQUALS, "[": Keycode.LEFT_BRACKET,
+    "]": Keycode.RIGHT_BRACKET, "\\": Keycode.BACKSLASH,
+    ";": Keycode.SEMICOLON, "'": Keycode.QUOTE, "`": Keycode.GRAVE_ACCENT,
+    ",": Keycode.COMMA, ".": Keycode.PERIOD, "/": Keycode.FORWARD_SLASH,
+    "0": Keycode.ZERO,
+}
+
+class KeyboardLayoutUS:
+    """
+    US keyboard layout, turning characters into the keycodes that type
+    them.
+    """
+    def __init__(self, keyboard):
+        self.keyboard = keyboard
+
+    def keycodes(self, char):
+        if "a" <= char <= "z":
+            return (Keycode.A + ord(char) - ord("a"),)
+        if "A" <= char <= "Z":
+            return (Keycode.SHIFT, Keycode.A + ord(char) - ord("A"))
+        if "1" <= char <= "9":
+            return (Keycode.ONE + ord(char) - ord("1"),)
+        if char in _UNSHIFTED:
+            return (_UNSHIFTED[char],)
+        if char in _SHIFTED:
+            return (Keycode.SHIFT, _SHIFTED[char])
+        raise ValueError("No keycode available for character {!r}".format(char))
+
+    def write(self, string):
+        for char in string:
+            self.keyboard.press(*self.keycodes(char))
+            self.keyboard.release_all()
+
+class ConsumerControl:
+    """
+    Consumer control device sending a 16 bit usage code per report.
+    """
+    def __init__(self, devices):
+        self._device = find_device(devices, 0x0C, 0x01)
+        self._report = bytearray(2)
+
+    def send(self, consumer_code):
+        self.press(consumer_code)
+        self.release()
+
+    def press(self, consumer_code):
+        self._report[0] = consumer_code & 0xFF
+        self._report[1] = consumer_code >> 8
+        self._device.send_report(self._report)
+
+    def release(self):
+        self._report[0] = 0
+        self._report[1] = 0
+        self._device.send_report(self._report)
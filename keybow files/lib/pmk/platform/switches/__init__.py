@@ -7,3 +7,34 @@ class Switches:
 
     def switch_state(self, idx):
         raise NotImplementedError
+
+    def read_all(self):
+        # Returns the state of every switch as a single integer bitmask,
+        # with bit n set when switch n is pressed. Backends that can read
+        # all of their switches in one go should override this.
+
+        mask = 0
+        for idx in range(self.num_switches()):
+            if self.switch_state(idx):
+                mask |= 1 << idx
+        return mask
+
+    def queues_events(self):
+        # Returns True if these switches are scanned and debounced in the
+        # background, and their transitions should be taken from
+        # `read_event()` rather than by polling `read_all()`.
+
+        return False
+
+    def read_event(self):
+        # Returns the oldest queued transition as a (number, pressed,
+        # timestamp) tuple, with the timestamp in `pmk.ticks_ms()` time, or
+        # None if there are none left.
+
+        return None
+
+    def light_sleep(self):
+        # Puts the board into light sleep until a switch is pressed.
+        # Returns False straight away if these switches can't wake it.
+
+        return False
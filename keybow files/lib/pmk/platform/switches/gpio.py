@@ -1,13 +1,23 @@
 from digitalio import DigitalInOut, Direction, Pull
 
+try:
+    import alarm
+except ImportError:
+    alarm = None
+
 from . import Switches
 
 class GPIO(Switches):
     """
-    Switches connected directly to GPIO
+    Switches connected directly to GPIO. Any of them can wake the board
+    from light sleep.
     """
     def __init__(self, pins):
-        self._switches = [DigitalInOut(pin) for pin in pins]
+        self._pins = pins
+        self._setup()
+
+    def _setup(self):
+        self._switches = [DigitalInOut(pin) for pin in self._pins]
         for switch in self._switches:
             switch.direction = Direction.INPUT
             switch.pull = Pull.UP
@@ -17,3 +27,27 @@ class GPIO(Switches):
 
     def switch_state(self, idx):
         return not self._switches[idx].value
+
+    def read_all(self):
+        mask = 0
+        bit = 1
+        for switch in self._switches:
+            if not switch.value:
+                mask |= bit
+            bit <<= 1
+        return mask
+
+    def light_sleep(self):
+        if alarm is None:
+            return False
+
+        # Pin alarms need the pins to themselves, so the switches are
+        # released while sleeping and set up again on wake.
+        for switch in self._switches:
+            switch.deinit()
+        try:
+            alarms = [alarm.pin.PinAlarm(pin, value=False, pull=True) for pin in self._pins]
+            alarm.light_sleep_until_alarms(*alarms)
+        finally:
+            self._setup()
+        return True
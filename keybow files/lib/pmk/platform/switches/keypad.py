@@ -0,0 +1,76 @@
+import keypad
+
+try:
+    import alarm
+except ImportError:
+    alarm = None
+
+from . import Switches
+
+class Keypad(Switches):
+    """
+    Switches connected directly to GPIO, scanned and debounced in the
+    background by CircuitPython's keypad module. Transitions are queued
+    with their timestamps, so none are lost while the main loop is busy.
+
+    :param interval: seconds between background scans, which is also the
+                     debounce time
+    :param max_events: transitions queued before the oldest are dropped
+    """
+    def __init__(self, pins, interval=0.005, max_events=64):
+        self._pins = pins
+        self._interval = interval
+        self._max_events = max_events
+        self._event = keypad.Event()
+        self._state = 0
+        self._setup()
+
+    def _setup(self):
+        self._keys = keypad.Keys(self._pins, value_when_pressed=False, pull=True,
+                                 interval=self._interval, max_events=self._max_events)
+
+    def num_switches(self):
+        return self._keys.key_count
+
+    def switch_state(self, idx):
+        return bool(self.read_all() & (1 << idx))
+
+    def read_all(self):
+        # Only for callers that poll: catches up with the queue, dropping
+        # any presses that started and ended in between.
+
+        while self.read_event() is not None:
+            pass
+        return self._state
+
+    def queues_events(self):
+        return True
+
+    def read_event(self):
+        event = self._event
+        if not self._keys.events.get_into(event):
+            return None
+
+        bit = 1 << event.key_number
+        if event.pressed:
+            self._state |= bit
+        else:
+            self._state &= ~bit
+        # keypad timestamps come from supervisor.ticks_ms(), the same clock
+        # as pmk's ticks.
+        return event.key_number, event.pressed, event.timestamp
+
+    def light_sleep(self):
+        if alarm is None:
+            return False
+
+        # As with GPIO, pin alarms need the pins to themselves. Anything
+        # still queued is dropped, as the scanner is restarted on wake.
+        self._keys.deinit()
+        self._state = 0
+        try:
+            alarms = [alarm.pin.PinAlarm(pin, value=False, pull=True) for pin in self._pins]
+            alarm.light_sleep_until_alarms(*alarms)
+        finally:
+            self._setup()
+        return True
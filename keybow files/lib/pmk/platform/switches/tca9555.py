@@ -2,21 +2,42 @@ from . import Switches
 
 class TCA9555(Switches):
     """
-    Switches connected via TCA9555 IO expander on i2c
+    Switches connected via one or more TCA9555 IO expanders on i2c. Each
+    expander has 16 inputs; switch n is input n % 16 of the expander at
+    `addresses[n // 16]`. Every expander is read in a single bus lock.
+
+    :param addresses: i2c addresses of the expanders, in switch order
     """
-    def __init__(self, i2c, count):
+    def __init__(self, i2c, count, addresses=(0x20,)):
+        if count > 16 * len(addresses):
+            raise ValueError("{} switches need {} expanders".format(count, (count + 15) // 16))
         self._count = count
         self._i2c = i2c
+        self._addresses = tuple(addresses[:(count + 15) // 16])
+        self._mask = (1 << count) - 1
+        # Input port 0 register, after which port 1 is read back-to-back
+        self._command = bytearray(1)
+        # Input ports 0 and 1 of every expander, in switch order
+        self._buffer = bytearray(2 * len(self._addresses))
 
     def num_switches(self):
         return self._count
 
     def switch_state(self, idx):
-        buffer = bytearray(self._count // 8)
-        buffer[0] = 0x0
+        return bool(self.read_all() & (1 << idx))
+
+    def read_all(self):
+        buffer = self._buffer
         while not self._i2c.try_lock():
             pass
-        self._i2c.writeto_then_readfrom(0x20, buffer, buffer, out_end=1)
-        self._i2c.unlock()
-        b = buffer[0] | buffer[1] << 8 # up to 16 buttons supported now
-        return not (1 << idx) & b
+        try:
+            start = 0
+            for address in self._addresses:
+                self._i2c.writeto_then_readfrom(address, self._command, buffer,
+                                                in_start=start, in_end=start + 2)
+                start += 2
+        finally:
+            self._i2c.unlock()
+        b = int.from_bytes(buffer, "little")
+        # Inputs are pulled up, so a pressed switch reads as 0
+        return ~b & self._mask
@@ -0,0 +1,115 @@
+import sys
+import time
+from array import array
+
+try:
+    import supervisor
+except ImportError:
+    supervisor = None
+
+# Stages of a frame, in the order they run. FRAME is the frame as a whole,
+# less WAIT.
+WAIT = 0    # waiting for the governor's next scan slot
+READ = 1    # reading and debouncing the switches
+KEYS = 2    # key states, events, holds, combos and LED sleep
+LEDS = 3    # flushing changed LEDs to the hardware
+APP = 4     # everything between calls to `update()`: handling events,
+            # sending HID reports
+FRAME = 5
+_NAMES = ("wait", "read", "keys", "leds", "app", "frame")
+
+def _us():
+    return time.monotonic_ns() // 1000
+
+class Profiler:
+    """
+    Times the stages of every frame run by `PMK.update()` in microseconds,
+    counting them into fixed-bucket histograms held in preallocated arrays,
+    along with each stage's total and worst time and how many frames went
+    over budget. Set `PMK.profiler` to one to turn profiling on; with it
+    left as None nothing is timed or allocated.
+
+    :param budget: microseconds a frame, less waiting, should take; longer
+                   frames are counted in `missed`
+    :param bucket: width of each histogram bucket in microseconds
+    :param buckets: number of buckets per stage; the last one also counts
+                    everything longer
+    """
+    def __init__(self, budget=1000, bucket=100, buckets=16):
+        self.budget = budget
+        self.bucket = bucket
+        self.buckets = buckets
+        self.counts = array("L", [0] * (len(_NAMES) * buckets))
+        self.totals = array("Q", [0] * len(_NAMES))
+        self.max = array("L", [0] * len(_NAMES))
+        self.frames = 0
+        self.missed = 0
+        self._last = 0
+        self._busy = 0
+
+    def frame(self):
+        # Ends the current frame, counting the time since its last stage
+        # as application time, and starts the next.
+
+        if self._last:
+            self.mark(APP)
+            busy = self._busy
+            self._add(FRAME, busy)
+            self.frames += 1
+            if busy > self.budget:
+                self.missed += 1
+        else:
+            self._last = _us()
+        self._busy = 0
+
+    def mark(self, stage):
+        # Ends `stage`, which ran from the end of the previous one until now.
+
+        now = _us()
+        elapsed = now - self._last
+        self._last = now
+        self._add(stage, elapsed)
+        if stage != WAIT:
+            self._busy += elapsed
+
+    def _add(self, stage, elapsed):
+        idx = elapsed // self.bucket
+        if idx >= self.buckets:
+            idx = self.buckets - 1
+        self.counts[stage * self.buckets + idx] += 1
+        self.totals[stage] += elapsed
+        if elapsed > self.max[stage]:
+            self.max[stage] = elapsed
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        for i in range(len(_NAMES)):
+            self.totals[i] = 0
+            self.max[i] = 0
+        self.frames = 0
+        self.missed = 0
+        self._last = 0
+
+    def dump(self):
+        # Prints a summary to the serial console: the mean and worst time
+        # of each stage and its histogram, as counts per bucket.
+
+        print("frames {}, missed {} (budget {} us)".format(self.frames, self.missed, self.budget))
+        print("stage   mean us   max us   counts per {} us".format(self.bucket))
+        for stage in range(len(_NAMES)):
+            start = stage * self.buckets
+            counts = self.counts[start:start + self.buckets]
+            runs = sum(counts)
+            mean = self.totals[stage] // runs if runs else 0
+            print("{:<6}{:>9}{:>9}   {}".format(_NAMES[stage], mean, self.max[stage],
+                                               " ".join(str(c) for c in counts)))
+
+    def poll_serial(self, key="p"):
+        # Dumps the summary when `key` is typed on the serial console. Call
+        # this from the main loop.
+
+        if supervisor is None or not supervisor.runtime.serial_bytes_available:
+            return
+        if sys.stdin.read(1) == key:
+            self.dump()
@@ -0,0 +1,89 @@
+import asyncio
+
+from . import ticks_ms, ticks_add, ticks_diff
+
+class Runtime:
+    """
+    Runs a PMK under asyncio, with key scanning, LED refresh and event
+    handling as separate tasks, so each runs at its own rate and a slow
+    handler never holds up scanning. Scanned events are passed from the
+    scan task to the event task through the PMK's event queue. If the PMK
+    has a `governor`, its intervals are used in place of `scan_hz` and
+    `led_hz`, so both tasks slow down while the keys are idle.
+
+    :param keybow: the PMK instance to run
+    :param scan_hz: rate the switches are scanned at
+    :param led_hz: rate changed LEDs are flushed to the hardware at
+    """
+    def __init__(self, keybow, scan_hz=1000, led_hz=60):
+        self.keybow = keybow
+        self.scan_interval = 1000 // scan_hz
+        self.led_interval = 1000 // led_hz
+        self.running = False
+        self.missed_scans = 0
+        self._events_ready = asyncio.Event()
+
+    async def scan_task(self):
+        # Scans at a fixed rate, waking the event task when there are
+        # events to handle. If a scan overruns its slot the schedule is
+        # reset rather than trying to catch up.
+
+        next_scan = ticks_ms()
+        while self.running:
+            self.keybow.scan()
+            if len(self.keybow.event_queue):
+                self._events_ready.set()
+
+            next_scan = ticks_add(next_scan, self._interval(self.scan_interval, True))
+            now = ticks_ms()
+            delay = ticks_diff(next_scan, now)
+            if delay < 0:
+                self.missed_scans += 1
+                next_scan = now
+                delay = 0
+            await asyncio.sleep(delay / 1000)
+
+    async def led_task(self):
+        while self.running:
+            self.keybow.flush()
+            await asyncio.sleep(self._interval(self.led_interval, False) / 1000)
+
+    def _interval(self, interval, scan):
+        # Returns the governor's scan or LED interval, or `interval` if the
+        # PMK doesn't have a governor.
+
+        governor = self.keybow.governor
+        if governor is None:
+            return interval
+        return governor.scan_interval if scan else governor.led_interval
+
+    async def event_task(self, handler):
+        # Calls `handler(event, number, timestamp)` for each queued event.
+
+        while self.running:
+            await self._events_ready.wait()
+            self._events_ready.clear()
+            for event, number, timestamp in self.keybow.events():
+                handler(event, number, timestamp)
+
+    async def run(self, handler, *tasks):
+        # Runs the scan, LED and event tasks, plus any extra coroutines
+        # (e.g. one sending HID output), until `stop()` is called. Use it
+        # as follows:
+
+        # runtime = Runtime(keybow)
+        # asyncio.run(runtime.run(handle_event, hid_task()))
+
+        self.running = True
+        await asyncio.gather(
+            self.scan_task(),
+            self.led_task(),
+            self.event_task(handler),
+            *tasks
+        )
+
+    def stop(self):
+        # Stops every task; the event task is woken so it can exit.
+
+        self.running = False
+        self._events_ready.set()
@@ -0,0 +1,42 @@
+import time
+
+try:
+    import supervisor
+except ImportError:
+    supervisor = None
+
+# Ticks are integer milliseconds that wrap at 2**29, like
+# supervisor.ticks_ms(), so they always fit in a small int and reading or
+# comparing them never allocates, however long the board has been running.
+# Compare them with `ticks_diff()` and offset them with `ticks_add()`,
+# rather than with - and +.
+_TICKS_PERIOD = 1 << 29
+_TICKS_MASK = _TICKS_PERIOD - 1
+_TICKS_HALF = _TICKS_PERIOD // 2
+
+# Times since something that can grow without limit, such as how long the
+# keys have been idle, are capped at this many milliseconds (about 37
+# hours), well inside the range `ticks_diff()` can tell apart.
+TICKS_MAX_AGE = _TICKS_PERIOD // 4
+
+def ticks_ms():
+    # Returns the current time in ticks. On the board it's read from
+    # `supervisor.ticks_ms()`, which returns a small int, rather than
+    # `time.monotonic_ns()`, whose result has to be allocated on the heap.
+
+    if supervisor is None:
+        return (time.monotonic_ns() // 1000000) & _TICKS_MASK
+    return supervisor.ticks_ms()
+
+def ticks_add(ticks, delta):
+    # Returns `ticks` moved on by `delta` milliseconds, which may be
+    # negative.
+
+    return (ticks + delta) & _TICKS_MASK
+
+def ticks_diff(end, start):
+    # Returns the milliseconds from `start` to `end`, negative if `end` is
+    # earlier. Correct while they are less than 2**28 ms (about 3 days)
+    # apart.
+
+    return ((end - start + _TICKS_HALF) & _TICKS_MASK) - _TICKS_HALF
@@ -0,0 +1,313 @@
+from pmk import ticks_ms, ticks_add, ticks_diff
+
+# Step kinds. Each step is a (kind, argument) tuple.
+PRESS = 1        # press a tuple of keycodes, keeping them held
+RELEASE_ALL = 2  # release every key held by PRESS steps
+TAP = 3          # press and release a tuple of keycodes
+WAIT = 5         # wait a number of milliseconds
+TYPE = 6         # type a string, a few characters per update
+TYPE_KEYS = 7    # type a tuple of keycode groups from typer.pack_string,
+                 # pressing each group in a single report
+ROLL_KEYS = 8    # type a tuple of single character keycode groups from
+                 # typer.pack_string, pressing each in the report that
+                 # releases the one before where it can
+
+# A keyboard report has six key slots. Keycodes from _FIRST_MODIFIER up
+# are modifiers, which are sent as bits instead of taking a slot.
+_KEY_SLOTS = 6
+_FIRST_MODIFIER = 0xE0
+
+class Scheduler:
+    """
+    Runs actions as sequences of timed steps, advancing them from the main
+    loop instead of sleeping, so scanning and LEDs keep running while long
+    actions (app launches, typing) play out. Actions run one after another
+    in the order they were added, so one action's output never interleaves
+    with another's. Keys held with `hold()` are pressed straight away,
+    outside that order, and can be down while actions run, except while an
+    action is holding keys of its own (such as the WIN+R of an app launch):
+    they wait for those to be released, so they don't join its shortcut.
+    Steps only ever release keys they pressed themselves, so keys held
+    down by other key presses stay down. Keys held with `hold()` keep their
+    report slots, and typing only uses the slots left over, waiting if
+    there are none.
+
+    :param hid: keymap.HID with the devices steps are sent to
+    :param chars_per_update: characters (or packed key groups) typed per
+                             call to `update()`
+    :param max_report_rate: most characters or key groups typed per second,
+                            or None for no limit
+    """
+    def __init__(self, hid, chars_per_update=1, max_report_rate=None):
+        self.hid = hid
+        self.chars_per_update = chars_per_update
+        self.report_interval = 1000 // max_report_rate if max_report_rate else 0
+        self._queue = []
+        self._steps = None
+        self._step = 0
+        self._char = 0
+        self._wait_until = None
+        self._pressed = ()
+        self._held = ()
+        self._deferred = []
+        self._rolled = ()
+
+    def busy(self):
+        # Returns True while any steps are running or queued.
+
+        return self._steps is not None or len(self._queue) > 0
+
+    def add(self, steps):
+        # Queues a sequence of steps to run after any already queued.
+
+        self._queue.append(steps)
+
+    def cancel(self):
+        # Drops all queued steps and releases any held keys.
+
+        self._queue = []
+        self._steps = None
+        self._wait_until = None
+        self._release()
+
+    def hold(self, keycodes):
+        # Presses keycodes and keeps them down until `unhold()`, e.g. while
+        # a key on the keypad is held. Raises ValueError if there aren't
+        # enough free slots in the report. While a PRESS step's keys are
+        # down they're pressed once those are released instead.
+
+        if self._pressed:
+            self._deferred.append([keycodes, False])
+            return
+        self._held += keycodes
+        try:
+            self.hid.keyboard.press(*keycodes)
+        except Exception:
+            self.unhold(keycodes)
+            raise
+
+    def unhold(self, keycodes):
+        # Releases keycodes pressed by `hold()`, apart from any still held
+        # by another call to it. Keys whose press is still waiting are
+        # pressed and released together when it comes, so it isn't lost.
+
+        for deferred in self._deferred:
+            if deferred[0] == keycodes and not deferred[1]:
+                deferred[1] = True
+                return
+        held = list(self._held)
+        for code in keycodes:
+            if code in held:
+                held.remove(code)
+        self._held = tuple(held)
+        released = tuple(c for c in keycodes if c not in held and c not in self._pressed)
+        if released:
+            self.hid.keyboard.release(*released)
+
+    def update(self, now=None):
+        # Runs steps until one has to wait for a later frame. Call this
+        # once per iteration of the main loop, passing the frame's time
+        # from `PMK.ticks`.
+
+        if now is None:
+            now = ticks_ms()
+
+        if self._wait_until is not None:
+            if ticks_diff(now, self._wait_until) < 0:
+                return
+            self._wait_until = None
+
+        budget = self.chars_per_update
+        while True:
+            if self._steps is None:
+                if not self._queue:
+                    return
+                self._steps = self._queue.pop(0)
+                self._step = 0
+                self._char = 0
+
+            if self._step >= len(self._steps):
+                self._steps = None
+                continue
+
+            kind, arg = self._steps[self._step]
+            try:
+                # Keyboard steps wait until enough report slots are free.
+                # Typing needs one, as its keys can be pressed a few at a
+                # time.
+                if kind == PRESS or kind == TAP:
+                    if self._free_slots() < min(_key_count(arg), _KEY_SLOTS):
+                        return
+                elif kind == TYPE or kind == TYPE_KEYS or kind == ROLL_KEYS:
+                    if self._free_slots() < 1:
+                        return
+
+                if kind == TYPE:
+                    if budget == 0:
+                        return
+                    end = min(len(arg), self._char + budget)
+                    for char in arg[self._char:end]:
+                        self._tap(self.hid.layout.keycodes(char))
+                    budget -= end - self._char
+                    self._char = end
+                    if self._char < len(arg):
+                        self._pace(now)
+                        return
+                    self._char = 0
+                elif kind == TYPE_KEYS:
+                    if budget == 0:
+                        return
+                    self._tap(arg[self._char])
+                    budget -= 1
+                    self._char += 1
+                    if self._char < len(arg):
+                        if self._pace(now):
+                            return
+                        continue
+                    self._char = 0
+                elif kind == ROLL_KEYS:
+                    if budget == 0:
+                        return
+                    self._roll(arg[self._char])
+                    budget -= 1
+                    self._char += 1
+                    if self._char < len(arg):
+                        if self._pace(now):
+                            return
+                        continue
+                    self._unroll()
+                    self._char = 0
+                elif kind == WAIT:
+                    self._step += 1
+                    self._wait_until = ticks_add(now, arg)
+                    return
+                elif kind == PRESS:
+                    self._pressed += arg
+                    self.hid.keyboard.press(*arg)
+                elif kind == RELEASE_ALL:
+                    self._release()
+                elif kind == TAP:
+                    self._tap(arg)
+            except Exception as e:
+                # A step that fails, such as typing a character the layout
+                # has no key for, drops the rest of its action, rather than
+                # stopping the main loop or being retried every frame.
+                print("Error running action:", e)
+                self._steps = None
+                self._wait_until = None
+                self._release()
+                continue
+
+            self._step += 1
+
+    def _tap(self, keycodes):
+        # Presses and releases keycodes, splitting the keys over several
+        # reports if there aren't enough free slots for all of them.
+
+        free = self._free_slots()
+        if _key_count(keycodes) <= free:
+            self._press_release(keycodes)
+            return
+        modifiers = tuple(c for c in keycodes if c >= _FIRST_MODIFIER)
+        keys = tuple(c for c in keycodes if c < _FIRST_MODIFIER)
+        for i in range(0, len(keys), free):
+            self._press_release(modifiers + keys[i:i + free])
+
+    def _press_release(self, keycodes):
+        # Keys are released even if pressing them failed part way, apart
+        # from ones held with `hold()`.
+
+        try:
+            self.hid.keyboard.press(*keycodes)
+        finally:
+            released = tuple(c for c in keycodes if c not in self._held)
+            if released:
+                self.hid.keyboard.release(*released)
+
+    def _roll(self, keycodes):
+        # Presses the next character's keycodes for a ROLL_KEYS step,
+        # leaving them down until the character after. The previous
+        # character's key is released in the same report if it had the same
+        # modifiers and was a different key, so the host sees one key go
+        # down at a time, in order, with one report per character.
+        # Otherwise it's released in a report of its own first.
+
+        previous = self._rolled
+        if previous and _rolls_into(previous, keycodes):
+            # Take the previous key out of the report without sending it;
+            # pressing the new key sends both changes together
+            report = self.hid.keyboard.report
+            for i in range(2, 8):
+                if report[i] in previous and report[i] not in self._held:
+                    report[i] = 0
+        else:
+            self._unroll()
+        self._rolled = keycodes
+        self.hid.keyboard.press(*keycodes)
+
+    def _unroll(self):
+        # Releases the key left down by `_roll()`, if any.
+
+        if self._rolled:
+            released = tuple(c for c in self._rolled if c not in self._held)
+            self._rolled = ()
+            if released:
+                self.hid.keyboard.release(*released)
+
+    def _free_slots(self):
+        # Returns how many key slots in the report aren't taken by held
+        # keys.
+
+        used = []
+        for code in self._held + self._pressed:
+            if code < _FIRST_MODIFIER and code not in used:
+                used.append(code)
+        return _KEY_SLOTS - len(used)
+
+    def _release(self):
+        self._unroll()
+        if self._pressed:
+            released = tuple(c for c in self._pressed if c not in self._held)
+            self._pressed = ()
+            if released:
+                self.hid.keyboard.release(*released)
+        self._hold_deferred()
+
+    def _hold_deferred(self):
+        # Presses the keys `hold()` was asked to press while a PRESS step's
+        # keys were down, releasing any whose key has been released since.
+
+        deferred = self._deferred
+        self._deferred = []
+        for keycodes, released in deferred:
+            try:
+                self.hold(keycodes)
+            except Exception as e:
+                print("Error holding keys:", e)
+                continue
+            if released:
+                self.unhold(keycodes)
+
+    def _pace(self, now):
+        # Holds off typing for `report_interval`, if a rate limit is set.
+        # Returns True if it did.
+
+        if self.report_interval:
+            self._wait_until = ticks_add(now, self.report_interval)
+            return True
+        return False
+
+def _rolls_into(previous, keycodes):
+    # Returns True if a character's keycodes from typer.pack_string can be
+    # pressed in the report releasing the previous character's: each is a
+    # single key after the same modifiers, and the keys differ.
+
+    last = len(keycodes) - 1
+    return (last == len(previous) - 1 and keycodes[last] != previous[last]
+            and _key_count(keycodes) == 1 and _key_count(previous) == 1
+            and keycodes[:last] == previous[:last])
+
+def _key_count(keycodes):
+    # Returns how many report slots keycodes take, leaving out modifiers.
+
+    return len([c for c in keycodes if c < _FIRST_MODIFIER])
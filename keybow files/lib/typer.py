@@ -0,0 +1,42 @@
+# Keycodes from here up are modifiers (CONTROL, SHIFT, ALT, GUI), which are
+# sent as bits in the report rather than taking one of its six key slots.
+_FIRST_MODIFIER = 0xE0
+
+def pack_string(text, layout, keys_per_report=1):
+    # Converts a string into a tuple of keycode groups, each of which can be
+    # pressed in a single keyboard report and released before the next.
+    # Consecutive characters share a group when they need the same
+    # modifiers and don't repeat a key already in it, so "hello world"
+    # takes 4 press reports instead of 11. Keys within a report have no
+    # order as far as the host is concerned, so it may register a group's
+    # characters in any order; only use more than one key per report where
+    # that's known to work. With one key per report, each character is a
+    # group of its own, for the scheduler's ROLL_KEYS steps.
+
+    groups = []
+    keys = []
+    modifiers = ()
+    for char in text:
+        codes = layout.keycodes(char)
+        char_modifiers = tuple(c for c in codes if c >= _FIRST_MODIFIER)
+        char_keys = [c for c in codes if c < _FIRST_MODIFIER]
+
+        if keys and (char_modifiers != modifiers
+                     or len(char_keys) != 1
+                     or len(keys) + 1 > keys_per_report
+                     or char_keys[0] in keys):
+            groups.append(modifiers + tuple(keys))
+            keys = []
+
+        if not keys:
+            modifiers = char_modifiers
+        keys.extend(char_keys)
+
+        # Characters typed with more than one key get a report to themselves.
+        if len(char_keys) != 1:
+            groups.append(modifiers + tuple(keys))
+            keys = []
+
+    if keys:
+        groups.append(modifiers + tuple(keys))
+    return tuple(groups)
@@ -1,4 +1,6 @@
 import json
+import struct
+import zlib
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox
 import requests
@@ -7,6 +9,7 @@ import zipfile
 import tempfile
 import shutil
 from pathlib import Path
+from urllib.parse import quote
 
 # Global configuration object
 config = {}
@@ -15,7 +18,11 @@ current_layer_display = None  # For updating the layer display
 # GitHub repository information
 GITHUB_REPO = "BenCos17/keybow"
 GITHUB_API_BASE = "https://api.github.com/repos"
-FIRMWARE_PATH = "keybow%20files/code.py"  # Path to your firmware file in the repository (URL encoded)
+FIRMWARE_DIR = "keybow files"  # Folder in the repository copied to the Keybow2040
+# Files in that folder an update leaves alone: the user's own config, the
+# docs, and the simulator, which only runs on a computer
+FIRMWARE_SKIP = ("config.json", "config.bin")
+FIRMWARE_SKIP_DIRS = ("lib/pmk/platform/simulated/",)
 
 # Keybow2040 layout - 4x4 grid (modifier key 0 in bottom left)
 KEYBOW_LAYOUT = [
@@ -93,6 +100,88 @@ PRESET_APPS = {
     "Services": {"shortcut": "WIN+R", "command": "services.msc"}
 }
 
+# Binary keymap written alongside config.json as config.bin. The firmware
+# reads the header, layer index and combos at boot and only loads the
+# records of the active layer, see keymap.py in the keybow files. All
+# values are little-endian:
+#   header:  magic "KBKM", version, number of keys, number of layers,
+#            number of combos, size and CRC-32 of the config.json it was
+#            built from (the firmware ignores config.bin if they differ)
+#   index:   per layer: number, r, g, b, file offset, size, record count
+#   combos:  per combo: number of keys, window in ms, the key numbers,
+#            then a record (key 0)
+#   records: per key: key number, kind, r, g, b, payload length, payload
+KEYMAP_MAGIC = b"KBKM"
+KEYMAP_VERSION = 3
+KEYMAP_MIN_KEYS = 16
+KEYMAP_KIND_CODE = 1
+KEYMAP_KIND_APP = 2
+
+def pack_keymap_record(key, value, color):
+    """Pack one key (or combo) entry into a binary keymap record"""
+    if isinstance(value, dict):
+        color = value.get("color", color)
+        if value.get("type") == "app":
+            kind = KEYMAP_KIND_APP
+            payload = value.get("shortcut", "").encode("utf-8")
+            if "command" in value:
+                payload += b"\0" + value["command"].encode("utf-8")
+        else:
+            kind = KEYMAP_KIND_CODE
+            payload = value.get("code", "").encode("utf-8")
+    else:
+        kind = KEYMAP_KIND_CODE
+        payload = str(value).encode("utf-8")
+    return struct.pack("<BBBBBH", int(key), kind, *color, len(payload)) + payload
+
+def build_binary_keymap(config, source=b""):
+    """Pack a config into the binary keymap format read by the firmware.
+    `source` is the saved config.json the keymap is built from"""
+    layers = []
+    num_keys = KEYMAP_MIN_KEYS
+    for layer_id, layer in config.get("layers", {}).items():
+        try:
+            number = int(layer_id)
+        except ValueError:
+            continue
+        color = layer.get("color", [0, 0, 255])
+        records = b""
+        count = 0
+        for key, value in layer.get("keys", {}).items():
+            records += pack_keymap_record(key, value, color)
+            num_keys = max(num_keys, int(key) + 1)
+            count += 1
+        layers.append((number, color, records, count))
+
+    combos = b""
+    combo_count = 0
+    for combo in config.get("combos", []):
+        keys = bytes(int(key) for key in combo.get("keys", []))
+        combos += struct.pack("<BH", len(keys), int(combo.get("window", 50))) + keys
+        combos += pack_keymap_record(0, combo, [0, 0, 0])
+        combo_count += 1
+
+    header = struct.pack("<4sBBBBII", KEYMAP_MAGIC, KEYMAP_VERSION, num_keys, len(layers), combo_count,
+                         len(source), zlib.crc32(source))
+    offset = len(header) + struct.calcsize("<BBBBIHH") * len(layers) + len(combos)
+    index = b""
+    body = b""
+    for number, color, records, count in layers:
+        index += struct.pack("<BBBBIHH", number, *color, offset + len(body), len(records), count)
+        body += records
+    return header + index + combos + body
+
+def save_binary_keymap(json_path):
+    """Write the binary keymap next to a saved config.json"""
+    bin_path = os.path.splitext(json_path)[0] + ".bin"
+    # Read back what was written, so the size and CRC match the file on
+    # disk, line endings included
+    with open(json_path, "rb") as f:
+        source = f.read()
+    with open(bin_path, "wb") as f:
+        f.write(build_binary_keymap(config, source))
+    return bin_path
+
 def create_key_map():
     """Create a visual key map showing the Keybow2040 layout with actual functions"""
     map_window = tk.Toplevel()
@@ -372,12 +461,10 @@ def check_for_updates():
         response = requests.get(f"{GITHUB_API_BASE}/{GITHUB_REPO}/commits/main")
         if response.status_code == 200:
             commit_data = response.json()
-            latest_commit = commit_data['sha'][:8]  # Short commit hash
+            commit_sha = commit_data['sha']
+            latest_commit = commit_sha[:8]  # Short commit hash
             commit_date = commit_data['commit']['author']['date'][:10]  # Date only
             
-            # Get the raw content of the firmware file
-            raw_url = f"https://raw.githubusercontent.com/{GITHUB_REPO}/main/{FIRMWARE_PATH}"
-            
             # Show update dialog
             update_dialog = tk.Toplevel()
             update_dialog.title("Update Available")
@@ -396,7 +483,7 @@ def check_for_updates():
             def download_update():
                 try:
                     update_dialog.destroy()
-                    download_and_install_firmware(raw_url, latest_commit)
+                    download_and_install_firmware(commit_sha)
                 except Exception as e:
                     messagebox.showerror("Error", f"Failed to download update: {e}")
             
@@ -414,8 +501,65 @@ def check_for_updates():
     except Exception as e:
         messagebox.showerror("Error", f"Failed to check for updates: {e}")
 
-def download_and_install_firmware(raw_url, commit_hash):
-    """Download and install firmware from GitHub"""
+def list_firmware_files(commit_sha):
+    """List the firmware files at a commit, as paths relative to FIRMWARE_DIR,
+    with code.py last"""
+    response = requests.get(f"{GITHUB_API_BASE}/{GITHUB_REPO}/git/trees/{commit_sha}",
+                            params={"recursive": "1"})
+    if response.status_code != 200:
+        raise Exception(f"Failed to list firmware files: HTTP {response.status_code}")
+    tree = response.json()
+    if tree.get("truncated"):
+        raise Exception("The repository listing from GitHub was incomplete")
+    
+    prefix = FIRMWARE_DIR + "/"
+    files = []
+    for entry in tree["tree"]:
+        path = entry["path"]
+        if entry["type"] != "blob" or not path.startswith(prefix):
+            continue
+        rel_path = path[len(prefix):]
+        if rel_path in FIRMWARE_SKIP or rel_path.endswith(".md") or rel_path.startswith(FIRMWARE_SKIP_DIRS):
+            continue
+        files.append(rel_path)
+    if "code.py" not in files:
+        raise Exception(f"No code.py in {FIRMWARE_DIR} at commit {commit_sha[:8]}")
+    
+    # code.py imports everything else, so it's copied last: the board
+    # restarts as each file is written, and must never run a new code.py
+    # against the old lib
+    files.sort(key=lambda rel_path: rel_path == "code.py")
+    return files
+
+def download_firmware(commit_sha, folder, status=None):
+    """Download the firmware files at a commit into a folder, returning their
+    relative paths. `status` is called with each file's path"""
+    files = list_firmware_files(commit_sha)
+    for rel_path in files:
+        if status:
+            status(rel_path)
+        url = f"https://raw.githubusercontent.com/{GITHUB_REPO}/{commit_sha}/{quote(FIRMWARE_DIR + '/' + rel_path)}"
+        response = requests.get(url)
+        if response.status_code != 200:
+            raise Exception(f"Failed to download {rel_path}: HTTP {response.status_code}")
+        local_path = os.path.join(folder, *rel_path.split("/"))
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with open(local_path, "wb") as f:
+            f.write(response.content)
+    return files
+
+def install_firmware(folder, files, keybow_path):
+    """Copy downloaded firmware files onto the Keybow2040, in order"""
+    for rel_path in files:
+        target = os.path.join(keybow_path, *rel_path.split("/"))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(os.path.join(folder, *rel_path.split("/")), target)
+
+def download_and_install_firmware(commit_sha):
+    """Download the firmware (code.py and the lib folder it needs) at a commit
+    from GitHub and install it on the Keybow2040"""
+    commit_hash = commit_sha[:8]
+    tmp_dir = tempfile.mkdtemp(prefix="keybow-firmware-")
     try:
         # Create progress dialog
         progress_dialog = tk.Toplevel()
@@ -433,27 +577,27 @@ def download_and_install_firmware(raw_url, commit_hash):
         
         progress_dialog.update()
         
-        # Download the firmware file directly
-        status_label.config(text="Downloading code.py from GitHub...")
-        progress_dialog.update()
-        
-        response = requests.get(raw_url)
-        if response.status_code != 200:
-            raise Exception(f"Failed to download: HTTP {response.status_code}")
+        # Download every file first, so a failed download leaves the
+        # Keybow2040 untouched
+        def show_status(rel_path):
+            status_label.config(text=f"Downloading {rel_path}...")
+            progress_dialog.update()
         
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.py') as tmp_file:
-            tmp_file.write(response.content)
-            tmp_file_path = tmp_file.name
+        files = download_firmware(commit_sha, tmp_dir, show_status)
         
         status_label.config(text="Installing firmware...")
         progress_dialog.update()
         
+        save_path = os.path.join(os.path.expanduser("~"), "Downloads", f"keybow-firmware-{commit_hash}")
+        
+        def save_to_downloads():
+            shutil.copytree(tmp_dir, save_path, dirs_exist_ok=True)
+        
         # Copy to Keybow directory
         keybow_path = get_keybow_path()
         if keybow_path:
             try:
-                shutil.copy2(tmp_file_path, os.path.join(keybow_path, 'code.py'))
+                install_firmware(tmp_dir, files, keybow_path)
                 messagebox.showinfo("Success", f"Firmware updated to commit {commit_hash}!\nPlease restart your Keybow2040.")
             except PermissionError:
                 # Handle permission denied error
@@ -482,7 +626,7 @@ Solutions to try:
 
 4. **Try manual installation**:
    - The firmware has been saved to Downloads
-   - Copy it manually to your Keybow2040
+   - Copy everything in that folder to your Keybow2040
                 """
                 
                 text_widget = tk.Text(error_dialog, height=15, width=60)
@@ -491,8 +635,7 @@ Solutions to try:
                 text_widget.config(state=tk.DISABLED)
                 
                 # Save to Downloads as fallback
-                save_path = os.path.join(os.path.expanduser("~"), "Downloads", "code.py")
-                shutil.copy2(tmp_file_path, save_path)
+                save_to_downloads()
                 
                 def try_again():
                     error_dialog.destroy()
@@ -500,16 +643,16 @@ Solutions to try:
                     new_keybow_path = get_keybow_path()
                     if new_keybow_path:
                         try:
-                            shutil.copy2(tmp_file_path, os.path.join(new_keybow_path, 'code.py'))
+                            install_firmware(save_path, files, new_keybow_path)
                             messagebox.showinfo("Success", f"Firmware updated to commit {commit_hash}!\nPlease restart your Keybow2040.")
                         except PermissionError:
                             messagebox.showerror("Still Locked", "The Keybow2040 is still locked.\nPlease try the manual installation method.")
                     else:
-                        messagebox.showinfo("Manual Installation", f"Firmware saved to: {save_path}\nPlease copy this file to your Keybow2040 manually.")
+                        messagebox.showinfo("Manual Installation", f"Firmware saved to: {save_path}\nPlease copy everything in this folder to your Keybow2040 manually.")
                 
                 def manual_install():
                     error_dialog.destroy()
-                    messagebox.showinfo("Manual Installation", f"Firmware saved to: {save_path}\nPlease copy this file to your Keybow2040 manually.")
+                    messagebox.showinfo("Manual Installation", f"Firmware saved to: {save_path}\nPlease copy everything in this folder to your Keybow2040 manually.")
                 
                 button_frame = tk.Frame(error_dialog)
                 button_frame.pack(pady=10)
@@ -520,18 +663,17 @@ Solutions to try:
                 messagebox.showerror("Error", f"Failed to install firmware: {e}")
         else:
             # If we can't find the Keybow path, save to a known location
-            save_path = os.path.join(os.path.expanduser("~"), "Downloads", "code.py")
-            shutil.copy2(tmp_file_path, save_path)
-            messagebox.showinfo("Success", f"Firmware downloaded to: {save_path}\nPlease copy this file to your Keybow2040 manually.")
-        
-        # Cleanup
-        os.unlink(tmp_file_path)
+            save_to_downloads()
+            messagebox.showinfo("Success", f"Firmware downloaded to: {save_path}\nPlease copy everything in this folder to your Keybow2040 manually.")
         
         progress_dialog.destroy()
         
     except Exception as e:
         progress_dialog.destroy()
         messagebox.showerror("Error", f"Failed to install firmware: {e}")
+    finally:
+        # Cleanup
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
 def get_keybow_path():
     """Try to find the Keybow2040 mount point"""
@@ -574,6 +716,7 @@ def upload_config_to_board():
         config_path = os.path.join(keybow_path, 'config.json')
         with open(config_path, 'w') as f:
             json.dump(config, f, indent=2)
+        save_binary_keymap(config_path)
         
         messagebox.showinfo("Success", f"Config uploaded to Keybow2040!\nPath: {config_path}")
         
@@ -1152,6 +1295,7 @@ def save_config():
     try:
         with open(path, "w") as f:
             json.dump(config, f, indent=2)
+        save_binary_keymap(path)
         messagebox.showinfo("Success", "Config saved successfully!")
     except Exception as e:
         messagebox.showerror("Error", f"Failed to save config: {e}")
@@ -0,0 +1,97 @@
+"""
+Builds a copy of the CIRCUITPY drive with the firmware precompiled.
+
+CircuitPython compiles every .py file it imports on each boot, which
+takes time and, while it runs, a lot of heap. This copies "keybow files"
+to an output folder with every .py file in lib (pmk, firmware, keymap,
+scheduler and typer) compiled to .mpy bytecode by mpy-cross. code.py,
+config.json and the libraries that already ship as .mpy are copied as
+they are. The simulated platform only runs on a host and is left out.
+
+    python tools/build_mpy.py
+    python tools/build_mpy.py --mpy-cross ~/bin/mpy-cross-9.2 --out build
+
+mpy-cross has to come from the CircuitPython release the board runs
+(see https://adafruit-circuit-python.s3.amazonaws.com/index.html?prefix=bin/mpy-cross/),
+since .mpy files only load on the version they were built for.
+Copy everything in the output folder to the drive, deleting the .py
+versions of any compiled modules already there: CircuitPython imports a
+.py file in preference to an .mpy file with the same name.
+
+The firmware prints how long it took from code.py starting to the first
+switch scan on the serial console; compare it before and after.
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SOURCE = os.path.join(HERE, "..", "keybow files")
+OUT = os.path.join(HERE, "..", "dist", "CIRCUITPY")
+
+# Folders, relative to the source, that aren't copied to the board.
+SKIP = (os.path.join("lib", "pmk", "platform", "simulated"),)
+
+def find_mpy_cross(path):
+    # Returns the full path to mpy-cross, or exits if it can't be found.
+
+    found = shutil.which(path)
+    if found is None:
+        sys.exit("mpy-cross not found at {!r}: download the one for your CircuitPython "
+                 "version and pass it with --mpy-cross, or set MPY_CROSS".format(path))
+    return found
+
+def compile_mpy(mpy_cross, source, target, name):
+    # Compiles `source` to `target`, naming it `name` in tracebacks.
+
+    result = subprocess.run([mpy_cross, "-s", name, "-o", target, source],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.exit("mpy-cross failed on {}:\n{}".format(source, result.stderr or result.stdout))
+
+def build(mpy_cross, source, out):
+    # Copies `source` to `out`, compiling lib's .py files. Returns the
+    # total size of the compiled sources and of their .mpy files.
+
+    if os.path.exists(out):
+        shutil.rmtree(out)
+
+    py_bytes = mpy_bytes = 0
+    for folder, dirs, files in os.walk(source):
+        rel = os.path.relpath(folder, source)
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__" and os.path.join(rel, d) not in SKIP)
+        os.makedirs(os.path.join(out, rel), exist_ok=True)
+
+        for name in sorted(files):
+            src = os.path.join(folder, name)
+            rel_name = os.path.normpath(os.path.join(rel, name))
+            compiled = name.endswith(".py") and rel_name.startswith("lib" + os.sep)
+            if not compiled:
+                shutil.copy2(src, os.path.join(out, rel_name))
+                continue
+
+            target = os.path.join(out, rel_name[:-3] + ".mpy")
+            compile_mpy(mpy_cross, src, target, rel_name.replace(os.sep, "/"))
+            py_bytes += os.path.getsize(src)
+            mpy_bytes += os.path.getsize(target)
+            print("compiled", rel_name)
+    return py_bytes, mpy_bytes
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the CIRCUITPY drive with pmk and the firmware as .mpy")
+    parser.add_argument("--mpy-cross", default=os.environ.get("MPY_CROSS", "mpy-cross"),
+                        help="mpy-cross for the board's CircuitPython version (default: $MPY_CROSS or mpy-cross)")
+    parser.add_argument("--source", default=SOURCE, help="folder with the drive's files")
+    parser.add_argument("--out", default=OUT, help="folder to build into; replaced if it exists")
+    args = parser.parse_args()
+
+    mpy_cross = find_mpy_cross(args.mpy_cross)
+    py_bytes, mpy_bytes = build(mpy_cross, os.path.normpath(args.source), os.path.normpath(args.out))
+    print("{} bytes of source compiled to {} bytes of .mpy in {}".format(
+        py_bytes, mpy_bytes, os.path.normpath(args.out)))
+
+if __name__ == "__main__":
+    main()